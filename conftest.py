@@ -1,7 +1,19 @@
+import os
+import re
+import base64
+import copy
+import hashlib
+import json
+import socket
+import asyncio
+import threading
 import mock
 import pytest
-import responses
-from osf_pigeon import settings
+from aioresponses import aioresponses
+from aiohttp import web
+from osf_pigeon import settings, pigeon
+
+HERE = os.path.dirname(os.path.abspath(__file__))
 
 
 @pytest.fixture
@@ -9,23 +21,37 @@ def mock_datacite(guid):
     with mock.patch.object(settings, "DOI_FORMAT", "{prefix}/osf.io/{guid}"):
         doi = settings.DOI_FORMAT.format(prefix=settings.DATACITE_PREFIX, guid=guid)
 
-        with responses.RequestsMock(assert_all_requests_are_fired=True) as rsps:
-            rsps.add(
-                responses.GET,
+        with aioresponses() as m:
+            m.get(
                 f"{settings.DATACITE_URL}metadata/{doi}",
                 status=200,
                 body=b"pretend this is XML.",
             )
-            yield rsps
+            yield m
 
 
 @pytest.fixture
 def mock_ia_client():
-    with mock.patch("osf_pigeon.pigeon.internetarchive.get_session") as mock_ia:
-        mock_session = mock.Mock()
+    with mock.patch("osf_pigeon.pigeon.internetarchive.get_session") as mock_ia, mock.patch(
+        "osf_pigeon.pigeon._ia_session", None
+    ):
+        pigeon._ia_item_cache.clear()
+        mock_session = mock.Mock(
+            protocol="https:", host="archive.org", headers={}, access_key="a", secret_key="s"
+        )
         mock_ia_item = mock.Mock()
+        mock_ia_item.item_metadata = {"metadata": {"description": "Test Description"}}
+        mock_ia_item.metadata = mock_ia_item.item_metadata["metadata"]
+        mock_ia_item.session = mock_session
         mock_ia.return_value = mock_session
+
+        def get_item(identifier, item_metadata=None):
+            mock_ia_item.identifier = identifier
+            return mock.DEFAULT
+
+        mock_session.get_item.side_effect = get_item
         mock_session.get_item.return_value = mock_ia_item
+        mock_session.send.return_value.json.return_value = {"success": True}
 
         # ⬇️ we only pass one mock into the test
         mock_ia.session = mock_session
@@ -34,3 +60,298 @@ def mock_ia_client():
             "osf_pigeon.pigeon.internetarchive.Item", return_value=mock_ia_item
         ):
             yield mock_ia
+
+
+def get_stand_in_file(guid, materialized_path):
+    return f"{guid}{materialized_path}\n".encode() * 4096
+
+
+def make_stand_in_app(registration_template):
+    """
+    Just enough of the OSF API, WaterButler, DataCite MDS and IA's S3 API for `pigeon.archive` to
+    run end to end against, for any guid.
+    """
+    routes = web.RouteTableDef()
+    max_page_size = 2  # small, so every listing is paginated
+    interrupted = set()
+
+    def base_url(request):
+        return f"http://{request.host}/"
+
+    def paginated(request, items):
+        page = int(request.query.get("page", 1))
+        per_page = min(int(request.query.get("page[size]", max_page_size)), max_page_size)
+        meta = {"total": len(items), "per_page": per_page}
+        return web.json_response(
+            {
+                "data": items[(page - 1) * per_page:page * per_page],
+                "links": {"next": "next" if page * per_page < len(items) else None, "meta": meta},
+                "meta": meta,
+            }
+        )
+
+    @routes.get("/v2/registrations/{guid}/")
+    async def registration(request):
+        guid = request.match_info["guid"]
+        data = copy.deepcopy(registration_template)
+        data["data"]["id"] = guid
+        data["data"]["attributes"].update(
+            title=guid, withdrawn=guid.startswith("withdrawn"), wiki_enabled=True
+        )
+        data["data"]["relationships"]["files"]["links"]["related"]["meta"] = {"count": 1}
+        data["data"]["relationships"]["registration_schema"]["links"]["related"][
+            "href"
+        ] = f"{base_url(request)}v2/schemas/registrations/schema0/"
+        data["data"]["embeds"]["identifiers"]["data"][0]["attributes"][
+            "value"
+        ] = f"10.70102/osf.io/{guid}"
+        return web.json_response(data)
+
+    @routes.get("/v2/registrations/{guid}/logs/")
+    async def logs(request):
+        guid = request.match_info["guid"]
+        return paginated(request, [{"id": f"{guid}-log-{i}"} for i in range(7)])
+
+    @routes.get("/v2/registrations/{guid}/wikis/")
+    async def wikis(request):
+        guid = request.match_info["guid"]
+        return paginated(request, [{"id": f"{guid}-wiki-{i}"} for i in range(3)])
+
+    @routes.get("/v2/registrations/{guid}/contributors/")
+    async def contributors(request):
+        guid = request.match_info["guid"]
+        return paginated(
+            request,
+            [
+                {
+                    "id": f"{guid}-{user}",
+                    "attributes": {"bibliographic": True},
+                    "embeds": {
+                        "users": {
+                            "data": {
+                                "id": user,
+                                "attributes": {"full_name": user},
+                                "relationships": {
+                                    "institutions": {
+                                        "links": {
+                                            "related": {
+                                                "href": f"{base_url(request)}v2/users/{user}/"
+                                                f"institutions/"
+                                            }
+                                        }
+                                    }
+                                },
+                            }
+                        }
+                    },
+                }
+                for user in ("brian", "reggie", "randall")
+            ],
+        )
+
+    @routes.get("/v2/users/{user}/institutions/")
+    async def user_institutions(request):
+        return web.json_response({"data": [{"attributes": {"name": "Center For Open Science"}}]})
+
+    def osfstorage_file(request, guid, materialized_path):
+        content = get_stand_in_file(guid, materialized_path)
+        return {
+            "id": f"{guid}{materialized_path}",
+            "attributes": {
+                "kind": "file",
+                "name": materialized_path.rsplit("/", 1)[-1],
+                "materialized_path": materialized_path,
+                "size": len(content),
+                "extra": {
+                    "hashes": {
+                        "md5": hashlib.md5(content).hexdigest(),
+                        "sha256": hashlib.sha256(content).hexdigest(),
+                    }
+                },
+            },
+            "links": {"download": f"{base_url(request)}download/{guid}{materialized_path}"},
+        }
+
+    @routes.get("/v2/registrations/{guid}/files/osfstorage/")
+    async def osfstorage(request):
+        guid = request.match_info["guid"]
+        folder = {
+            "id": f"{guid}/folder/",
+            "attributes": {"kind": "folder", "materialized_path": "/folder/"},
+            "relationships": {
+                "files": {
+                    "links": {
+                        "related": {
+                            "href": f"{base_url(request)}v2/registrations/{guid}/files/"
+                            f"osfstorage/folder/"
+                        }
+                    }
+                }
+            },
+        }
+        return paginated(
+            request,
+            [
+                osfstorage_file(request, guid, "/data.csv"),
+                folder,
+                osfstorage_file(request, guid, "/README.md"),
+            ],
+        )
+
+    @routes.get("/v2/registrations/{guid}/files/osfstorage/folder/")
+    async def osfstorage_folder(request):
+        guid = request.match_info["guid"]
+        return paginated(
+            request,
+            [
+                osfstorage_file(request, guid, path)
+                for path in ("/folder/analysis.R", "/folder/results.csv", "/folder/notes.txt")
+            ],
+        )
+
+    @routes.get("/download/{guid}/{path:.+}")
+    async def download(request):
+        """
+        Serves Range requests, but cuts the first download of every file off half way through.
+        """
+        key = (request.match_info["guid"], request.match_info["path"])
+        content = get_stand_in_file(*key[:1], f"/{key[1]}")
+        start = 0
+        if request.http_range.start is not None:
+            start = request.http_range.start
+        resp = web.StreamResponse(status=206 if start else 200)
+        resp.content_length = len(content) - start
+        await resp.prepare(request)
+        if start:
+            app["resumed"].append(key)
+        if key not in interrupted:
+            interrupted.add(key)
+            await resp.write(content[start:len(content) // 2])
+            request.transport.close()
+            return resp
+        await resp.write(content[start:])
+        await resp.write_eof()
+        return resp
+
+    @routes.get("/v2/registrations/{guid}/{relationship}/")
+    async def relationship(request):
+        return web.json_response({"data": [], "links": {"next": None}})
+
+    @routes.get("/v2/schemas/registrations/{schema_id}/")
+    async def registration_schema(request):
+        return web.json_response({"data": {"id": request.match_info["schema_id"]}})
+
+    @routes.get("/v1/resources/{guid}/providers/osfstorage/")
+    async def files(request):
+        return web.Response(body=f"archived files of {request.match_info['guid']}".encode())
+
+    @routes.get("/metadata/{doi:.+}")
+    async def datacite(request):
+        return web.Response(text=f"<resource>{request.match_info['doi']}</resource>")
+
+    s3_uploads = {}  # upload id -> (identifier, key, headers, {part number: bytes})
+
+    def s3_xml(tag, body):
+        return web.Response(
+            text=f'<{tag} xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{body}</{tag}>',
+            content_type="application/xml",
+        )
+
+    @routes.get("/s3/{identifier}")
+    async def s3_list_uploads(request):
+        identifier = request.match_info["identifier"]
+        return s3_xml(
+            "ListMultipartUploadsResult",
+            "".join(
+                f"<Upload><Key>{key}</Key><UploadId>{upload_id}</UploadId></Upload>"
+                for upload_id, (upload_identifier, key, _, _) in s3_uploads.items()
+                if upload_identifier == identifier
+            ),
+        )
+
+    @routes.post("/s3/{identifier}/{key}")
+    async def s3_initiate_or_complete(request):
+        identifier, key = request.match_info["identifier"], request.match_info["key"]
+        if "uploads" in request.query:
+            upload_id = f"upload{len(s3_uploads)}"
+            s3_uploads[upload_id] = (identifier, key, dict(request.headers), {})
+            return s3_xml("InitiateMultipartUploadResult", f"<UploadId>{upload_id}</UploadId>")
+
+        _, _, headers, parts = s3_uploads.pop(request.query["uploadId"])
+        numbers = [
+            int(number)
+            for number in re.findall(r"<PartNumber>(\d+)</PartNumber>", await request.text())
+        ]
+        app["s3_objects"][(identifier, key)] = (
+            headers, b"".join(parts[number] for number in numbers)
+        )
+        return s3_xml("CompleteMultipartUploadResult", f"<Key>{key}</Key>")
+
+    @routes.put("/s3/{identifier}/{key}")
+    async def s3_upload_part(request):
+        number = int(request.query["partNumber"])
+        body = await request.read()
+        app["s3_part_requests"].append(number)
+        if number in app["s3_failing_parts"]:
+            app["s3_failing_parts"].remove(number)
+            raise web.HTTPServiceUnavailable()
+        assert base64.b64decode(request.headers["Content-MD5"]) == hashlib.md5(body).digest()
+        s3_uploads[request.query["uploadId"]][3][number] = body
+        return web.Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+    @routes.get("/s3/{identifier}/{key}")
+    async def s3_list_parts(request):
+        parts = s3_uploads[request.query["uploadId"]][3]
+        return s3_xml(
+            "ListPartsResult",
+            "".join(
+                f"<Part><PartNumber>{number}</PartNumber>"
+                f'<ETag>"{hashlib.md5(body).hexdigest()}"</ETag></Part>'
+                for number, body in sorted(parts.items())
+            ) + "<IsTruncated>false</IsTruncated>",
+        )
+
+    app = web.Application()
+    app["resumed"] = []
+    app["s3_uploads"] = s3_uploads
+    app["s3_objects"] = {}
+    app["s3_part_requests"] = []
+    app["s3_failing_parts"] = set()
+    app.add_routes(routes)
+    return app
+
+
+@pytest.fixture
+def stand_in_servers():
+    """
+    Runs the stand-in OSF, WaterButler and DataCite servers on a background event loop and points
+    settings at them, yielding the stand-in app.
+    """
+    with open(os.path.join(HERE, "tests/fixtures/metadata-resp-with-embeds.json")) as fp:
+        registration_template = json.load(fp)
+
+    loop = asyncio.new_event_loop()
+    app = make_stand_in_app(registration_template)
+    runner = web.AppRunner(app)
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.SockSite(runner, sock).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{sock.getsockname()[1]}/"
+    try:
+        with mock.patch.multiple(
+            settings,
+            OSF_API_URL=url,
+            OSF_FILES_URL=url,
+            DATACITE_URL=url,
+            IA_S3_URL=f"{url}s3/",
+        ):
+            yield app
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
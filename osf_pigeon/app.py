@@ -1,9 +1,11 @@
+import json
+import asyncio
 import logging
 import requests
 from osf_pigeon import pigeon
 from concurrent.futures import ThreadPoolExecutor
 from osf_pigeon import settings
-from aiohttp import web
+from aiohttp import web, http_exceptions
 
 import sentry_sdk
 from sentry_sdk.integrations.aiohttp import AioHttpIntegration
@@ -15,6 +17,7 @@ sentry_sdk.init(
 )
 
 pigeon_jobs = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS, thread_name_prefix="pigeon_jobs")
+archive_jobs = set()  # the loop only holds weak references to running tasks
 app = web.Application()
 routes = web.RouteTableDef()
 logging.basicConfig(level=logging.DEBUG)
@@ -27,15 +30,21 @@ def handle_exception(future):
         app.logger.exception(exception)
 
 
+def archive_callback(ia_item, guid):
+    resp = requests.post(
+        f"{settings.OSF_API_URL}_/ia/{guid}/done/",
+        headers={"Authorization": f"Bearer {settings.OSF_BEARER_TOKEN}"},
+        json={"ia_url": ia_item.urls.details},
+    )
+    app.logger.info(f"{ia_item} called back with {resp}")
+
+
 def archive_task_done(future):
     if future.result() and not future.exception():
         ia_item, guid = future.result()
-        resp = requests.post(
-            f"{settings.OSF_API_URL}_/ia/{guid}/done/",
-            headers={"Authorization": f"Bearer {settings.OSF_BEARER_TOKEN}"},
-            json={"ia_url": ia_item.urls.details},
-        )
-        app.logger.info(f"{ia_item} called back with {resp}")
+        # archive jobs finish on the event loop, so make the blocking call back elsewhere
+        callback = pigeon_jobs.submit(archive_callback, ia_item, guid)
+        callback.add_done_callback(handle_exception)
 
 
 def metadata_task_done(future):
@@ -44,11 +53,35 @@ def metadata_task_done(future):
         app.logger.info(f"{ia_item} updated metadata {updated_metadata}")
 
 
+metadata_syncs = pigeon.MetadataSyncQueue(
+    pigeon.sync_metadata,
+    executor=pigeon.get_executor("metadata"),
+    callbacks=[handle_exception, metadata_task_done],
+)
+
+
+async def close_session(app):
+    await pigeon.close_session()
+
+
+app.on_cleanup.append(close_session)
+
+
 @routes.get("/")
 async def index(request):
     return web.json_response({"🐦": "👍"})
 
 
+@routes.get("/stats")
+async def stats(request):
+    """
+    Live tuning state for monitoring, currently the adaptive paging concurrency per endpoint.
+    :param request:
+    :return:
+    """
+    return web.json_response({"paging": pigeon.get_paging_stats()})
+
+
 @routes.get("/archive/{guid}")
 @routes.post("/archive/{guid}")
 async def archive(request):
@@ -59,23 +92,132 @@ async def archive(request):
     :return: json_response this just sends a simple message showing the request was recieved
     """
     guid = request.match_info["guid"]
-    future = pigeon_jobs.submit(pigeon.run, pigeon.archive(guid))
-    future.add_done_callback(handle_exception)
-    future.add_done_callback(archive_task_done)
-    return web.json_response({guid: future._state})
+    if settings.ARCHIVE_WORKER_MODE == "process":
+        task = asyncio.wrap_future(pigeon.submit_archive_job(guid))
+    else:
+        task = asyncio.ensure_future(pigeon.run_job(pigeon.archive(guid)))
+    archive_jobs.add(task)
+    task.add_done_callback(archive_jobs.discard)
+    task.add_done_callback(handle_exception)
+    task.add_done_callback(archive_task_done)
+    return web.json_response({guid: task._state})
 
 
 @routes.post("/metadata/{guid}")
 async def set_metadata(request):
     """
     This endpoint recieves json from osf.io when a registration is updated to sync IA item
-    metadata with the osf registration.
+    metadata with the osf registration. Updates to the same registration in quick succession are
+    synced together, see `pigeon.MetadataSyncQueue`.
     :param request:
     :return:
     """
     guid = request.match_info["guid"]
     metadata = await request.json()
-    future = pigeon_jobs.submit(pigeon.sync_metadata, guid, metadata)
-    future.add_done_callback(handle_exception)
-    future.add_done_callback(metadata_task_done)
+    try:
+        future = metadata_syncs.submit(guid, metadata)
+    except http_exceptions.PayloadEncodingError as e:
+        sentry_sdk.capture_exception(e)
+        return web.json_response({guid: str(e)}, status=400)
     return web.json_response({guid: future._state})
+
+
+async def read_lines(content, max_size):
+    """
+    Yields each line of `content` without its newline, or None in place of a line over `max_size`
+    bytes, which is skipped rather than held in memory. `StreamReader`'s own line reading fails the
+    whole stream on a line over its buffer limit instead.
+    """
+    line = bytearray()
+    too_long = False
+    async for chunk in content.iter_any():
+        *ended, rest = chunk.split(b"\n")
+        for part in ended:
+            line += b"" if too_long else part
+            yield None if too_long or len(line) > max_size else bytes(line)
+            line.clear()
+            too_long = False
+        if not too_long:
+            line += rest
+            too_long = len(line) > max_size
+            if too_long:
+                line.clear()
+    if line or too_long:
+        yield None if too_long else bytes(line)
+
+
+async def iter_ndjson(content):
+    """
+    Reads a `{guid: metadata}` object per line. A line that can't be read, or is over
+    `BULK_METADATA_MAX_LINE_SIZE`, is passed on as a `ValueError` in place of its metadata, under a
+    guid of None, to be reported as its result without failing the rest.
+    """
+    number = 0
+    async for line in read_lines(content, settings.BULK_METADATA_MAX_LINE_SIZE):
+        number += 1
+        try:
+            if line is None:
+                raise ValueError(
+                    f"Longer than the {settings.BULK_METADATA_MAX_LINE_SIZE} byte limit"
+                )
+            if not line.strip():
+                continue
+            updates = json.loads(line)
+            if not isinstance(updates, dict):
+                raise ValueError("Expected an object of guid to metadata")
+        except ValueError as e:
+            yield None, ValueError(f"Line {number}: {e}")
+            continue
+        for guid, metadata in updates.items():
+            yield guid, metadata
+
+
+async def iter_items(updates):
+    for guid, metadata in updates.items():
+        yield guid, metadata
+
+
+@routes.post("/metadata")
+async def set_metadata_bulk(request):
+    """
+    Bulk `/metadata/{guid}` for provider-wide changes. Takes a json object of `{guid: metadata}`,
+    or NDJSON with a `{guid: metadata}` object per line, and syncs every update with the same rules
+    as `/metadata/{guid}`, `BULK_METADATA_CONCURRENCY` at a time. json bodies are read whole and
+    capped at aiohttp's `client_max_size` (1 MiB), so large batches must be sent as NDJSON, which is
+    read as it arrives and whose lines may each be up to `BULK_METADATA_MAX_LINE_SIZE` bytes.
+    :param request:
+    :return: each guid's result, `{"updated": [keys]}` or `{"error": message}`, as one json object
+        or, for NDJSON, streamed back as a line per guid as each finishes, with a line of
+        `{"error": message}` for each line that couldn't be read
+    """
+    if request.content_type == "application/x-ndjson":
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        async for guid, result in pigeon.sync_metadata_bulk(
+            metadata_syncs, iter_ndjson(request.content)
+        ):
+            line = result if guid is None else {guid: result}  # no guid for an unreadable line
+            await resp.write(json.dumps(line).encode() + b"\n")
+        await resp.write_eof()
+        return resp
+
+    if request.content_type != "application/json":
+        return web.json_response(
+            {"error": "Expected application/json or application/x-ndjson"}, status=400
+        )
+    try:
+        updates = await request.json()
+    except web.HTTPRequestEntityTooLarge:
+        return web.json_response(
+            {"error": "Request body too large, send large batches as application/x-ndjson"},
+            status=413,
+        )
+    except ValueError as e:
+        return web.json_response({"error": f"Invalid json: {e}"}, status=400)
+    if not isinstance(updates, dict):
+        return web.json_response({"error": "Expected an object of guid to metadata"}, status=400)
+    results = {
+        guid: result
+        async for guid, result in pigeon.sync_metadata_bulk(metadata_syncs, iter_items(updates))
+    }
+    return web.json_response(results)
@@ -1,54 +1,926 @@
 import os
+import io
 import re
 import math
+import copy
 import json
+import base64
+import pickle
+import hashlib
+import shutil
 import tempfile
 import zipfile
+import xml.etree.ElementTree as ET
 import bagit
+import time
+import random
 import asyncio
-from datetime import datetime
+import logging
+import weakref
+import threading
+import itertools
+import collections
+import multiprocessing
+import contextvars
+import contextlib
+import traceback
+from functools import partial
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urlparse
 from asyncio import events
-from ratelimit import sleep_and_retry
-from ratelimit.exception import RateLimitException
-from aiohttp import ClientSession, ClientTimeout, http_exceptions
-
+from aiohttp import (
+    BasicAuth,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    ClientConnectionError,
+    ClientPayloadError,
+    ClientResponseError,
+    http_exceptions,
+)
+from yarl import URL
+
+import requests
 import internetarchive
-from datacite import DataCiteMDSClient
-from datacite.errors import DataCiteNotFoundError
+from requests.adapters import HTTPAdapter
+from internetarchive.auth import S3PostAuth
+from internetarchive.iarequest import S3PreparedRequest
+from datacite.errors import DataCiteError, DataCiteNotFoundError
 
 from osf_pigeon import settings
 
+logger = logging.getLogger(__name__)
+
+# One pooled session per event loop, aiohttp sessions can't be shared between loops.
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_session():
+    """
+    Returns the keep-alive `ClientSession` for the running event loop, creating it on first use so
+    every OSF API call made on that loop shares the same connection pool and DNS cache.
+    :return: ClientSession
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = TCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        session = ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class RateLimiter:
+    """
+    Token bucket for a single host that is shared by every archive job in the process, whichever
+    thread or event loop the job runs on. Callers are spaced out to `rate` requests per second
+    (with bursts of up to `burst`), at most `max_in_flight` requests may be open at once and a
+    `cool_down` (e.g. from a 429's `Retry-After`) pauses every caller until it has passed.
+    """
+
+    def __init__(self, rate, burst, max_in_flight):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._tat = 0  # theoretical arrival time of the next request at exactly `rate`
+        self._cooldown_until = 0
+        self._in_flight = 0
+        self._waiters = collections.deque()
+        self.throttle_count = 0  # 429s seen from this host, read by AdaptiveConcurrency
+
+    def _reserve(self):
+        """
+        Books the next slot in the schedule, returning how long the caller must wait to use it.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        start = max(now, self._cooldown_until)
+        if self.rate:
+            interval = 1 / self.rate
+            start = max(start, self._tat - (self.burst - 1) * interval)
+            self._tat = max(self._tat, start) + interval
+        return start - now
+
+    def cool_down(self, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._cooldown_until:
+                self._cooldown_until = until
+                if self.rate:  # resume at `rate` rather than as one burst when it expires
+                    self._tat = max(self._tat, until + (self.burst - 1) / self.rate)
+
+    async def _take_slot(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = waiter not in self._waiters
+                if not handed_over:
+                    self._waiters.remove(waiter)
+            if handed_over:  # release() gave us the slot just as we were cancelled
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                    return  # the slot passes straight to the waiter
+                except RuntimeError:  # the waiter's loop has been closed
+                    continue
+            self._in_flight -= 1
+
+    async def acquire(self):
+        await self._take_slot()
+        try:
+            with self._lock:
+                delay = self._reserve()
+            while delay > 0:
+                await asyncio.sleep(delay)
+                with self._lock:  # a cool-down may have started while we slept
+                    delay = self._reserve() if self._cooldown_until > time.monotonic() else 0
+        except BaseException:
+            self.release()
+            raise
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache holding at most `maxsize` entries, each of which expires `ttl` seconds
+    after it was set. Lives for the whole worker process so it is shared across archive jobs.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            expires, value = self._data.pop(key, (None, default))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(url):
+    """
+    Returns the process-wide `RateLimiter` for the host `url` points at.
+    """
+    origin = str(URL(url).origin())
+    with _rate_limiters_lock:
+        if origin not in _rate_limiters:
+            _rate_limiters[origin] = RateLimiter(
+                rate=settings.RATE_LIMIT_PER_SECOND,
+                burst=settings.RATE_LIMIT_BURST,
+                max_in_flight=settings.RATE_LIMIT_MAX_IN_FLIGHT,
+            )
+        return _rate_limiters[origin]
+
+
+def raise_for_status(resp, limiter):
+    """
+    `resp.raise_for_status()`, but a 429 with `Retry-After` first puts every job talking to that
+    host into a cool-down.
+    """
+    if resp.status == 429:
+        limiter.throttle_count += 1
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        if retry_after:
+            limiter.cool_down(retry_after)
+    resp.raise_for_status()
+
+
+def parse_retry_after(value):
+    """
+    `Retry-After` may be either a number of seconds or an HTTP date, returns seconds to wait or
+    None if the header is missing or unparsable.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def get_backoff(attempt):
+    """
+    Exponential backoff with full jitter, capped at `RETRY_BACKOFF_MAX`.
+    """
+    ceiling = min(settings.RETRY_BACKOFF_MAX, settings.RETRY_BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+async def retry(func, *args, retry_on=None, **kwargs):
+    """
+    Awaits `func(*args, **kwargs)` until it succeeds, sleeping on the event loop between attempts.
+    Responses with a status in `retry_on` (which are expected to be raised via
+    `raise_for_status()`), dropped connections and timeouts are retried with backoff, honoring
+    `Retry-After` when the server sends one. Gives up after `RETRY_MAX_ATTEMPTS` attempts or once
+    the next attempt would start after `RETRY_DEADLINE` seconds, re-raising the last error.
+    """
+    if retry_on is None:
+        retry_on = settings.RETRY_STATUSES
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.RETRY_DEADLINE
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await func(*args, **kwargs)
+        except ClientResponseError as e:
+            if e.status not in retry_on:
+                raise
+            error = e
+            delay = parse_retry_after((e.headers or {}).get("Retry-After"))
+        except (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError) as e:
+            error = e
+            delay = None
+
+        if delay is None:
+            delay = get_backoff(attempt)
+
+        if attempt >= settings.RETRY_MAX_ATTEMPTS or loop.time() + delay > deadline:
+            raise error
+
+        logger.warning(f"Attempt {attempt} failed with {error!r}, retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+async def _stream_to_file(from_url, path):
+    session = get_session()
+    limiter = get_rate_limiter(from_url)
+    async with limiter:
+        async with session.get(
+            from_url, timeout=ClientTimeout(total=settings.FILES_TIMEOUT)
+        ) as resp:
+            raise_for_status(resp, limiter)
+            async with open_async(path, payload=True) as fp:
+                async for chunk in resp.content.iter_any():
+                    await fp.write(chunk)
+
 
 async def stream_files_to_dir(from_url, to_dir, name):
-    async with ClientSession(timeout=ClientTimeout(total=settings.FILES_TIMEOUT)) as session:
-        async with session.get(from_url) as resp:
-            with open(os.path.join(to_dir, name), "wb") as fp:
+    await retry(_stream_to_file, from_url, os.path.join(to_dir, name))
+
+
+class FileIntegrityError(Exception):
+    """
+    A downloaded file doesn't match the size or hashes OSF reports for it.
+    """
+
+
+async def list_osfstorage_files(url):
+    """
+    Lists every file in the OSF Storage folder at `url`, walking its subfolders concurrently.
+    :return: list of OSF API file entities
+    """
+    data = await get_paginated_data(url)
+    if "data" in data:
+        data = data["data"]
+
+    files = []
+    folders = []
+    for item in data:
+        if item["attributes"]["kind"] == "folder":
+            folder_url = item["relationships"]["files"]["links"]["related"]["href"]
+            folders.append(
+                list_osfstorage_files(str(URL(folder_url).update_query({"page[size]": 100})))
+            )
+        else:
+            files.append(item)
+    for folder_files in await asyncio.gather(*folders):
+        files += folder_files
+    return files
+
+
+def get_file_size(path):
+    """
+    :return: size of `path` in bytes, 0 if it doesn't exist yet
+    """
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+async def _download_file(from_url, path, size, algorithms):
+    """
+    Downloads `from_url` to `path`, picking up where an earlier attempt left off with a Range
+    request if part of the file is already there.
+    :return: `PayloadFile` of the whole file
+    """
+    offset = await run_blocking("write", get_file_size, path)
+    if size is not None and offset > size:
+        offset = 0
+    if size is not None and offset == size:  # finished, but wasn't recorded
+        async with open_async(path, payload=True, append=True, algorithms=algorithms) as fp:
+            pass
+        return fp.raw.payload_file()
+
+    session = get_session()
+    limiter = get_rate_limiter(from_url)
+    # opened before the request, a response cut off while the file was being opened would lose
+    # what was already received
+    async with open_async(path, payload=True, append=bool(offset), algorithms=algorithms) as fp:
+        async with limiter:
+            async with session.get(
+                from_url,
+                headers={"Range": f"bytes={offset}-"} if offset else {},
+                timeout=ClientTimeout(total=settings.FILES_TIMEOUT),
+            ) as resp:
+                raise_for_status(resp, limiter)
+                # a server that ignores the Range sends the whole file again
+                if offset and resp.status != 206:
+                    await run_blocking("write", fp.raw.restart)
                 async for chunk in resp.content.iter_any():
-                    fp.write(chunk)
+                    await fp.write(chunk)
+    return fp.raw.payload_file()
+
+
+async def download_file(osf_file, to_dir):
+    """
+    Downloads an OSF Storage file to its path under `to_dir`, retrying (and resuming) like every
+    other request, then checks it against the size and hashes OSF has for it.
+    :param osf_file: OSF API file entity
+    """
+    attributes = osf_file["attributes"]
+    to_dir = os.path.abspath(to_dir)
+    path = os.path.abspath(os.path.join(to_dir, attributes["materialized_path"].lstrip("/")))
+    if not path.startswith(os.path.join(to_dir, "")):
+        raise FileIntegrityError(f"{attributes['materialized_path']} is outside of osfstorage")
+    await run_blocking("write", os.makedirs, os.path.dirname(path), exist_ok=True)
+
+    hashes = {
+        algorithm: digest
+        for algorithm, digest in (attributes.get("extra", {}).get("hashes") or {}).items()
+        if digest and algorithm in hashlib.algorithms_available
+    }
+    payload_file = await retry(
+        _download_file,
+        osf_file["links"]["download"],
+        path,
+        attributes.get("size"),
+        sorted(set(settings.BAG_CHECKSUMS) | hashes.keys()),
+    )
+
+    mismatched = [
+        algorithm
+        for algorithm, digest in hashes.items()
+        if payload_file.digests[algorithm] != digest
+    ]
+    if attributes.get("size") is not None and payload_file.size != attributes["size"]:
+        mismatched.append("size")
+    if mismatched:
+        await run_blocking("write", os.remove, path)
+        job_payload = _job_payload.get()
+        if job_payload is not None:
+            job_payload.pop(os.path.abspath(path), None)
+        raise FileIntegrityError(
+            f"{attributes['materialized_path']} doesn't match its {', '.join(mismatched)} on OSF"
+        )
+
+
+async def download_files_to_dir(guid, to_dir):
+    """
+    Downloads every file in the registration's OSF Storage to `to_dir`, laid out as it is on OSF,
+    `FILES_DOWNLOAD_CONCURRENCY` files at a time. Unlike the zip WaterButler streams this spreads
+    the download over several connections, and a failure only costs the rest of one file.
+    """
+    files = await list_osfstorage_files(
+        f"{settings.OSF_API_URL}v2/registrations/{guid}/files/osfstorage/?page[size]=100"
+    )
+    semaphore = asyncio.Semaphore(settings.FILES_DOWNLOAD_CONCURRENCY)
+
+    async def download(osf_file):
+        async with semaphore:
+            await download_file(osf_file, to_dir)
+
+    await asyncio.gather(*map(download, files))
 
 
 async def dump_json_to_dir(from_url, to_dir, name, parse_json=None):
-    pages = await get_paginated_data(from_url, parse_json)
-    with open(os.path.join(to_dir, name), "w") as fp:
-        json.dump(pages, fp)
+    """
+    Writes the response from `from_url` to `to_dir/name`, concatenating the `data` of every page
+    if it is paginated. Pages are written out as soon as the pages before them have been, so the
+    file is the same as `json.dump` of `get_paginated_data` without holding every page in memory.
+    """
+    data, is_paginated = await get_first_page(from_url, parse_json)
+    async with open_async(os.path.join(to_dir, name), payload=True) as fp:
+        if not is_paginated:
+            await fp.write(json.dumps(data))
+            return
+
+        separator = ""
+        await fp.write("[")
+        pages = iter_pages(from_url, data, parse_json)
+        try:
+            async for page in pages:
+                for item in page:
+                    await fp.write(separator)
+                    await fp.write(json.dumps(item))
+                    separator = ", "
+        finally:
+            await pages.aclose()
+        await fp.write("]")
 
-    return pages
+
+# Absolute path -> `PayloadFile` for every bag payload file the current archive job has written.
+_job_payload = contextvars.ContextVar("job_payload", default=None)
+
+PayloadFile = collections.namedtuple("PayloadFile", ["size", "digests"])
+
+
+class DigestingWriter(io.RawIOBase):
+    """
+    Raw binary stream that feeds every byte written through it to the bag's checksum algorithms
+    on its way to `fp`, so payload files are hashed as they are downloaded rather than re-read.
+    """
+
+    def __init__(self, fp, algorithms):
+        self._fp = fp
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        written = self._fp.write(b)
+        chunk = memoryview(b)[:written]
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+        self.size += written
+        return written
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+        super().close()
+
+    def resume(self, path):
+        """
+        Feeds the bytes already in `path` to the hashers, before appending to a partial download.
+        """
+        with open(path, "rb") as fp:
+            for block in iter(partial(fp.read, settings.BAG_HASH_CHUNK_SIZE), b""):
+                for hasher in self.hashers.values():
+                    hasher.update(block)
+                self.size += len(block)
+
+    def restart(self):
+        """
+        Empties the file and the hashers, for a resumed download that has to start over. The file is
+        opened for appending, so writes then go back to the start of it.
+        """
+        self._fp.truncate(0)
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in self.hashers}
+        self.size = 0
+
+    def payload_file(self):
+        return PayloadFile(
+            self.size,
+            {algorithm: hasher.hexdigest() for algorithm, hasher in self.hashers.items()},
+        )
+
+
+def write_all(fp, data):
+    """
+    Writes all of `data` to raw stream `fp`, which may write less than it is given.
+    """
+    view = memoryview(data)
+    while view:
+        view = view[fp.write(view):]
+
+
+class AsyncWriter:
+    """
+    Writes to a raw binary stream from the event loop without blocking it. Writes are coalesced into
+    blocks of whole `WRITE_CHUNK_SIZE` chunks, so the file is written at chunk-aligned offsets, and
+    written in order on the "write" executor while the caller carries on. Once `WRITE_BUFFER_SIZE`
+    bytes are waiting on the disk `write` waits for it to catch up.
+    """
+
+    def __init__(self, fp, chunk_size=None, buffer_size=None):
+        self.raw = self._fp = fp
+        self.chunk_size = chunk_size or settings.WRITE_CHUNK_SIZE
+        self.buffer_size = buffer_size or settings.WRITE_BUFFER_SIZE
+        self._buffer = bytearray()
+        self._blocks = collections.deque()
+        self._queued = 0
+        self._flushed = asyncio.Condition()
+        self._flusher = None
+        self._error = None
+
+    def _enqueue(self, block):
+        self._blocks.append(block)
+        self._queued += len(block)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        try:
+            while self._blocks:
+                await run_blocking("write", write_all, self._fp, self._blocks[0])
+                self._queued -= len(self._blocks.popleft())
+                async with self._flushed:
+                    self._flushed.notify_all()
+        except BaseException as e:
+            self._error = e
+            self._blocks.clear()
+            async with self._flushed:
+                self._flushed.notify_all()
+
+    async def write(self, data):
+        """
+        :param data: bytes, or str to write as UTF-8
+        """
+        if self._error:
+            raise self._error
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        if len(self._buffer) < self.chunk_size:
+            return
+
+        end = len(self._buffer) - len(self._buffer) % self.chunk_size
+        self._enqueue(bytes(self._buffer[:end]))
+        del self._buffer[:end]
+        async with self._flushed:
+            await self._flushed.wait_for(
+                lambda: self._queued <= self.buffer_size or self._error
+            )
+        if self._error:
+            raise self._error
+
+    async def aclose(self, abort=False):
+        """
+        Writes out whatever is left and closes the stream. With `abort`, for closing after the
+        caller failed, a failed write isn't raised over the caller's error; what was written is
+        still kept, so a partial download can be resumed.
+        """
+        if self._buffer and not self._error:
+            self._enqueue(bytes(self._buffer))
+            self._buffer.clear()
+        try:
+            if self._flusher is not None:
+                await asyncio.shield(self._flusher)
+        finally:
+            self._fp.close()
+        if self._error and not abort:
+            raise self._error
+
+
+@contextlib.asynccontextmanager
+async def open_async(path, payload=False, append=False, algorithms=None):
+    """
+    Opens `path` for writing from the event loop, yielding an `AsyncWriter`. With `payload` the file
+    is a bag payload file, hashed with `algorithms` (`BAG_CHECKSUMS` by default) as it is written
+    and, inside an archive job, its size and digests are recorded for `build_bag` once it has been
+    written successfully. The writer's `raw` stream is then a `DigestingWriter`.
+    """
+    fp = await run_blocking("write", open, path, "ab" if append else "wb", buffering=0)
+    job_payload = _job_payload.get() if payload else None
+    if job_payload is not None:
+        path = os.path.abspath(path)
+        job_payload.pop(path, None)
+    if payload:
+        fp = DigestingWriter(fp, algorithms or settings.BAG_CHECKSUMS)
+        if append:
+            await run_blocking("write", fp.resume, path)
+
+    writer = AsyncWriter(fp)
+    try:
+        yield writer
+    except BaseException:
+        await writer.aclose(abort=True)
+        raise
+    await writer.aclose()
+    if job_payload is not None:
+        job_payload[path] = fp.payload_file()
+
+
+def hash_file(path, algorithms):
+    """
+    Computes every digest in `algorithms` in a single read of `path`. Files over
+    `BAG_HASH_THREADED_SIZE` are hashed with one thread per algorithm (hashlib releases the GIL),
+    reading the next chunk while the last is being hashed, since one file's digest can't be split
+    across processes.
+    """
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    size = 0
+    with open(path, "rb") as fp:
+        if len(hashers) > 1 and os.fstat(fp.fileno()).st_size >= settings.BAG_HASH_THREADED_SIZE:
+            with ThreadPoolExecutor(max_workers=len(hashers)) as pool:
+                pending = []
+                for block in iter(partial(fp.read, settings.BAG_HASH_CHUNK_SIZE), b""):
+                    size += len(block)
+                    for future in pending:
+                        future.result()
+                    pending = [pool.submit(hasher.update, block) for hasher in hashers.values()]
+                for future in pending:
+                    future.result()
+        else:
+            for block in iter(partial(fp.read, settings.BAG_HASH_CHUNK_SIZE), b""):
+                size += len(block)
+                for hasher in hashers.values():
+                    hasher.update(block)
+    return PayloadFile(
+        size, {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+    )
+
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def discard_if_broken(pool):
+    """
+    A `ProcessPoolExecutor` whose worker died (e.g. was OOM killed on a large bag) fails everything
+    submitted to it from then on, so it is shut down for the caller to replace.
+    :return: `pool`, or None if it was broken
+    """
+    if pool is not None and pool._broken:
+        pool.shutdown(wait=False)
+        return None
+    return pool
+
+
+def get_hash_pool():
+    """
+    Process pool shared by every job for hashing payload that wasn't hashed as it was written.
+    Workers are spawned rather than forked, forking a process full of threads and event loops
+    isn't safe. A broken pool is replaced.
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        _hash_pool = discard_if_broken(_hash_pool)
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=settings.BAG_HASH_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _hash_pool
+
+
+def hash_files(paths, algorithms):
+    """
+    Hashes `paths` across `BAG_HASH_PROCESSES` processes.
+    :return: dict of path to `PayloadFile`
+    """
+    if settings.BAG_HASH_PROCESSES > 1 and len(paths) > 1:
+        try:
+            results = get_hash_pool().map(hash_file, paths, itertools.repeat(algorithms))
+        except BrokenProcessPool:  # broke since get_hash_pool checked it
+            results = get_hash_pool().map(hash_file, paths, itertools.repeat(algorithms))
+    else:
+        results = (hash_file(path, algorithms) for path in paths)
+    return dict(zip(paths, results))
+
+
+def build_bag(bag_dir, payload=None, algorithms=None):
+    """
+    Turns `bag_dir` into a BagIt bag in place, producing the same layout as `bagit.make_bag`.
+    Manifests are written from the digests recorded in `payload` while the files were written, so
+    the payload isn't read again; only files missing from it (or whose size no longer matches)
+    are hashed here. Uses absolute paths throughout and never changes the working directory.
+    """
+    algorithms = algorithms or settings.BAG_CHECKSUMS
+    payload = payload or {}
+    bag_dir = os.path.abspath(bag_dir)
+    data_dir = os.path.join(bag_dir, "data")
+
+    temp_data = tempfile.mkdtemp(dir=bag_dir)
+    for name in os.listdir(bag_dir):
+        path = os.path.join(bag_dir, name)
+        if path != temp_data:
+            os.rename(path, os.path.join(temp_data, name))
+    os.rename(temp_data, data_dir)
+    os.chmod(data_dir, os.stat(bag_dir).st_mode)
+
+    payload_files = {}
+    for dir_path, dir_names, file_names in os.walk(data_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            payload_file = payload.get(os.path.join(bag_dir, os.path.relpath(path, data_dir)))
+            if (
+                payload_file is None
+                or payload_file.size != os.path.getsize(path)
+                or not set(algorithms) <= payload_file.digests.keys()
+            ):
+                payload_file = None
+            payload_files[path] = payload_file
+
+    unhashed = [path for path, payload_file in payload_files.items() if payload_file is None]
+    payload_files.update(hash_files(unhashed, algorithms))
+
+    manifests = {algorithm: [] for algorithm in algorithms}
+    total_bytes = 0
+    for path, payload_file in payload_files.items():
+        relative_path = os.path.relpath(path, data_dir)
+        manifest_path = bagit._encode_filename("/".join(["data", *relative_path.split(os.sep)]))
+        for algorithm in algorithms:
+            manifests[algorithm].append(f"{payload_file.digests[algorithm]}  {manifest_path}\n")
+        total_bytes += payload_file.size
+    total_files = len(payload_files)
+
+    write_bag_tag_files(bag_dir, manifests, total_bytes, total_files)
+
+
+def write_bag_tag_files(bag_dir, manifests, total_bytes, total_files):
+    tag_files = {
+        "bagit.txt": "BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n",
+        "bag-info.txt": (
+            f"Bag-Software-Agent: osf-pigeon <https://github.com/CenterForOpenScience/osf-pigeon>\n"
+            f"Bagging-Date: {datetime.now().date()}\n"
+            f"Payload-Oxum: {total_bytes}.{total_files}\n"
+        ),
+    }
+    for algorithm, lines in manifests.items():
+        tag_files[f"manifest-{algorithm}.txt"] = "".join(lines)
+
+    for name, contents in tag_files.items():
+        with open(os.path.join(bag_dir, name), "w", encoding="utf-8") as fp:
+            fp.write(contents)
+
+    for algorithm in manifests:
+        with open(
+            os.path.join(bag_dir, f"tagmanifest-{algorithm}.txt"), "w", encoding="utf-8"
+        ) as fp:
+            for name, contents in tag_files.items():
+                digest = hashlib.new(algorithm, contents.encode("utf-8")).hexdigest()
+                fp.write(f"{digest} {name}\n")
+
+
+def validate_bag(bag_dir, payload=None):
+    """
+    Checks a bag built by `build_bag` in O(files) rather than O(bytes): its structure, that the
+    manifests list exactly the files present, Payload-Oxum and every file's size, and that the
+    manifests agree with the digests recorded while the payload was written. A random
+    `BAG_VALIDATION_SAMPLE_RATE` share of files is re-hashed too, or the whole payload when
+    `BAG_FULL_VALIDATION` is set.
+    :raises bagit.BagValidationError: if the bag is invalid
+    """
+    bag = bagit.Bag(bag_dir)
+    if settings.BAG_FULL_VALIDATION:
+        bag.validate()
+        return bag
+
+    bag.validate(completeness_only=True)
+    payload = payload or {}
+    errors = []
+    for relative_path, digests in bag.payload_entries().items():
+        path = os.path.join(bag.path, *relative_path.split("/"))
+        size = os.path.getsize(path)
+        payload_file = payload.get(os.path.join(bag.path, *relative_path.split("/")[1:]))
+        if payload_file is not None and payload_file.size != size:
+            errors.append(bagit.ManifestErrorDetail(relative_path))
+            continue
+        if random.random() < settings.BAG_VALIDATION_SAMPLE_RATE:
+            payload_file = hash_file(path, digests.keys())
+        if payload_file is None:
+            continue
+        for algorithm, expected in digests.items():
+            found = payload_file.digests.get(algorithm)
+            if found is not None and found != expected:
+                errors.append(bagit.ChecksumMismatch(relative_path, algorithm, expected, found))
+
+    if errors:
+        raise bagit.BagValidationError("Bag validation failed", errors)
+    return bag
+
+
+# Leading bytes of formats that are already compressed, deflating them again wastes CPU.
+COMPRESSED_SIGNATURES = (
+    b"PK\x03\x04",  # zip
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"\x89PNG",
+    b"\xff\xd8\xff",  # jpeg
+)
+
+
+def get_compress_type(path):
+    """
+    Bag files are deflated unless they look already compressed, by extension or magic bytes.
+    """
+    if os.path.splitext(path)[1].lower() in settings.ZIP_STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    with open(path, "rb") as fp:
+        if fp.read(8).startswith(COMPRESSED_SIGNATURES):
+            return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
 
 
 def create_zip(temp_dir):
-    with zipfile.ZipFile(os.path.join(temp_dir, "bag.zip"), "w") as fp:
-        for root, dirs, files in os.walk(os.path.join(temp_dir, "bag")):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_name = re.sub(f"^{temp_dir}", "", file_path)
-                fp.write(file_path, arcname=file_name)
+    """
+    Moves the bag in `temp_dir/bag` into `temp_dir/bag.zip`, streaming each file into the zip and
+    deleting it as soon as it's in, so a job needs about one copy of the bag in temp space rather
+    than two. Files are deflated unless `get_compress_type` finds them already compressed; jobs zip
+    their bags concurrently on the "bag" executor, so one job's zip is a single thread.
+    """
+    entries = []
+    for root, dirs, files in os.walk(os.path.join(temp_dir, "bag")):
+        for file in files:
+            file_path = os.path.join(root, file)
+            entries.append((file_path, re.sub(f"^{temp_dir}", "", file_path)))
+
+    with zipfile.ZipFile(os.path.join(temp_dir, "bag.zip"), "w", allowZip64=True) as fp:
+        for file_path, file_name in entries:
+            fp.write(
+                file_path,
+                arcname=file_name,
+                compress_type=get_compress_type(file_path),
+                compresslevel=settings.ZIP_COMPRESSION_LEVEL,
+            )
+            os.remove(file_path)
 
 
-async def get_relationship_attribute(key, url, func):
+async def get_relationship_attribute(key, url, func, include=None):
     data = await get_paginated_data(url)
     if "data" in data:
-        return {key: list(map(func, data["data"]))}
-    return {key: list(map(func, data))}
+        data = data["data"]
+    return {key: list(map(func, filter(include, data)))}
+
+
+def get_contributors_url(guid):
+    # archive() and get_metadata_for_ia_item() share this so a job only pages contributors once
+    return f"{settings.OSF_API_URL}v2/registrations/{guid}/contributors/?page[size]=100"
 
 
 def get_contributor_info(contrib):
@@ -93,9 +965,9 @@ async def get_metadata_for_ia_item(json_metadata):
     relationship_data = [
         get_relationship_attribute(
             "creator",
-            f'{settings.OSF_API_URL}v2/registrations/{json_metadata["data"]["id"]}/contributors/'
-            f"?filter[bibliographic]=true&",
+            get_contributors_url(json_metadata["data"]["id"]),
             get_contributor_info,
+            include=lambda contrib: contrib["attributes"]["bibliographic"],
         ),
         get_relationship_attribute(
             "affiliated_institutions",
@@ -169,6 +1041,52 @@ async def get_metadata_for_ia_item(json_metadata):
     return ia_metadata
 
 
+# DOI -> DataCite XML metadata
+_datacite_cache = TTLCache(settings.DATACITE_CACHE_SIZE, settings.DATACITE_CACHE_TTL)
+
+
+def get_datacite_url():
+    """
+    DataCite's MDS API base URL, defaulting and ending in a slash the way `DataCiteMDSClient` did.
+    """
+    return (settings.DATACITE_URL or "https://mds.datacite.org/").rstrip("/") + "/"
+
+
+async def _get_datacite_xml(doi):
+    url = f"{get_datacite_url()}metadata/{doi}"
+    auth = None
+    if settings.DATACITE_USERNAME:
+        auth = BasicAuth(settings.DATACITE_USERNAME, settings.DATACITE_PASSWORD or "")
+    limiter = get_rate_limiter(url)
+    async with limiter:
+        async with get_session().get(
+            url, headers={"Accept": "application/xml"}, auth=auth
+        ) as resp:
+            if resp.status in settings.RETRY_STATUSES:
+                raise_for_status(resp, limiter)
+            if resp.status != 200:
+                raise DataCiteError.factory(resp.status, await resp.text())
+            return await resp.text()
+
+
+async def get_datacite_metadata(doi):
+    """
+    Fetches the XML metadata DataCite's MDS API holds for `doi` on the event loop's pooled session,
+    so it overlaps with the job's other downloads, retrying like every other request.
+    :param doi: str
+    :return: str
+    :raises DataCiteError: the subclass for the status DataCite responded with
+    """
+    xml_metadata = _datacite_cache.get(doi)
+    if xml_metadata is None:
+        try:
+            xml_metadata = await retry(_get_datacite_xml, doi)
+        except ClientResponseError as e:  # still throttled or unavailable after retrying
+            raise DataCiteError.factory(e.status, e.message) from e
+        _datacite_cache.set(doi, xml_metadata)
+    return xml_metadata
+
+
 async def write_datacite_metadata(guid, temp_dir, metadata):
     try:
         doi = next(
@@ -182,154 +1100,566 @@ async def write_datacite_metadata(guid, temp_dir, metadata):
         raise DataCiteNotFoundError(
             f"Datacite DOI not found for registration {guid} on OSF server."
         )
-    client = DataCiteMDSClient(
-        url=settings.DATACITE_URL,
-        username=settings.DATACITE_USERNAME,
-        password=settings.DATACITE_PASSWORD,
-        prefix=settings.DATACITE_PREFIX,
-    )
     try:
-        xml_metadata = client.metadata_get(doi)
+        xml_metadata = await get_datacite_metadata(doi)
     except DataCiteNotFoundError:
         raise DataCiteNotFoundError(
             f"Datacite DOI {doi} not found for registration {guid} on Datacite server."
         )
 
-    with open(os.path.join(temp_dir, "datacite.xml"), "w") as fp:
-        fp.write(xml_metadata)
+    async with open_async(os.path.join(temp_dir, "datacite.xml")) as fp:
+        await fp.write(xml_metadata)
 
     return xml_metadata
 
 
-@sleep_and_retry
-async def get_with_retry(url, retry_on=(), sleep_period=None, headers=None):
+class HTTPCache:
+    """
+    On-disk cache of OSF API response bodies and their `ETag`/`Last-Modified` validators, shared by
+    every job (and process) pointed at the same directory. Entries are single files, a JSON header
+    line followed by the body, replaced atomically; once the directory grows past `max_bytes` the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory))
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def get(self, url):
+        """
+        :return: (headers, body) for `url` or None if it isn't cached
+        """
+        path = self._path(url)
+        try:
+            with open(path, "rb") as fp:
+                headers = json.loads(fp.readline())
+                body = fp.read().decode()
+            os.utime(path)  # keeps eviction least recently used
+        except (OSError, ValueError):
+            return None
+        if headers.get("url") != url:  # hash collision
+            return None
+        return headers, body
+
+    def set(self, url, body, etag=None, last_modified=None):
+        path = self._path(url)
+        header = json.dumps({"url": url, "etag": etag, "last_modified": last_modified})
+        data = header.encode() + b"\n" + body.encode()
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as fp:
+            fp.write(data)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(temp_path, path)
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(os.scandir(self.directory), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_bytes * 0.9:  # leave some headroom before the next purge
+                break
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    """
+    Returns the process' `HTTPCache`, or None when `HTTP_CACHE_DIR` isn't set.
+    """
+    global _http_cache
+    if not settings.HTTP_CACHE_DIR:
+        return None
+    with _http_cache_lock:
+        if _http_cache is None or _http_cache.directory != settings.HTTP_CACHE_DIR:
+            _http_cache = HTTPCache(settings.HTTP_CACHE_DIR, settings.HTTP_CACHE_MAX_BYTES)
+        return _http_cache
+
+
+def is_immutable(url):
+    return any(re.search(pattern, url) for pattern in settings.HTTP_CACHE_IMMUTABLE_URLS)
+
+
+async def _get_text(url, headers):
+    cache = get_http_cache()
+    cached = await run_blocking("write", cache.get, url) if cache else None
+    if cached:
+        cached_headers, cached_body = cached
+        if is_immutable(url):
+            return cached_body
+        headers = dict(headers)
+        if cached_headers["etag"]:
+            headers["If-None-Match"] = cached_headers["etag"]
+        if cached_headers["last_modified"]:
+            headers["If-Modified-Since"] = cached_headers["last_modified"]
+
+    session = get_session()
+    limiter = get_rate_limiter(url)
+    async with limiter:
+        async with session.get(url, headers=headers) as resp:
+            if cached and resp.status == 304:
+                return cached_body
+            raise_for_status(resp, limiter)
+            body = await resp.text()
+
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if cache and (etag or last_modified or is_immutable(url)):
+                await run_blocking("write", cache.set, url, body, etag, last_modified)
+            return body
+
+
+# Normalized URL -> future of the response body for requests made by the current archive job.
+_job_requests = contextvars.ContextVar("job_requests", default=None)
+
+
+def start_job_requests():
+    """
+    Scopes request de-duplication to the calling task (an archive job) and the tasks it spawns.
+    """
+    _job_requests.set({})
+
+
+def normalize_url(url):
+    """
+    The key requests are de-duplicated on: query parameters sorted, blank ones (e.g. from a
+    trailing `&`, which some versions of yarl keep) dropped and no fragment.
+    """
+    url = URL(url)
+    query = sorted((key, value) for key, value in url.query.items() if key)
+    return str(url.with_query(query).with_fragment(None))
+
+
+def _settle_job_request(requests, key, future):
+    # Failures may be retried by a later caller, bulky endpoints are only coalesced while in flight.
+    if (
+        future.cancelled()
+        or future.exception()
+        or get_paging_endpoint(key) not in settings.JOB_MEMOIZED_ENDPOINTS
+    ):
+        requests.pop(key, None)
+
+
+async def get_with_retry(url, retry_on=None, headers=None):
+    """
+    GETs JSON from the OSF API with retries. Within an archive job identical requests are made
+    once, concurrent callers await the same response and responses from the endpoints in
+    `JOB_MEMOIZED_ENDPOINTS` are kept for the rest of the job; each caller gets its own copy.
+    """
+    requests = _job_requests.get()
+    if requests is None or headers:
+        return json.loads(await _get_with_retry(url, retry_on, headers))
+
+    key = normalize_url(url)
+    future = requests.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_get_with_retry(url, retry_on))
+        requests[key] = future
+        future.add_done_callback(partial(_settle_job_request, requests, key))
+    return json.loads(await asyncio.shield(future))
+
+
+async def _get_with_retry(url, retry_on=None, headers=None):
     if not headers:
         headers = {}
 
     if settings.OSF_BEARER_TOKEN:
         headers["Authorization"] = f"Bearer {settings.OSF_BEARER_TOKEN}"
 
-    async with ClientSession() as session:
-        async with session.get(url, headers=headers) as resp:
-            if resp.status in retry_on:
-                raise RateLimitException(
-                    message="Too many requests, sleeping.",
-                    period_remaining=sleep_period
-                    or int(resp.headers.get("Retry-After") or 0),
-                )  # This will be caught by @sleep_and_retry and retried
-            resp.raise_for_status()
-            return await resp.json()
-
-
-async def get_pages(url, page, result=None, parse_json=None, semaphore=None):
-    if result is None:
-        result = {}
-    url = f"{url}?page={page}&page={page}"
-    data = {}
-    if semaphore is None:
-        data = await get_with_retry(url, retry_on=(429,))
+    return await retry(_get_text, url, headers, retry_on=retry_on)
+
+
+# Last concurrency learned for each paginated endpoint and the controllers currently paging it.
+_paging_limits = {}
+_paging_controllers = {}
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on how many pages of one endpoint are fetched at once. Each page that comes back
+    at a steady latency without the host throttling us adds `1 / limit` (so roughly one more page
+    in flight per round trip); a 429 or a page slower than `PAGING_LATENCY_TOLERANCE` times the
+    best smoothed latency seen multiplies the limit by `PAGING_BACKOFF_FACTOR`, at most once per
+    round trip.
+    """
+
+    def __init__(self, endpoint, limit=None):
+        self.endpoint = endpoint
+        self.limit = float(limit or settings.PAGING_SEMAPHORE)
+        self.latency = None  # exponentially weighted moving average, in seconds
+        self.best_latency = None
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._condition = asyncio.Condition()
+
+    def _record(self, latency, throttled):
+        now = time.monotonic()
+        self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+
+        slow = latency > self.best_latency * settings.PAGING_LATENCY_TOLERANCE
+        if throttled or slow:
+            if now - self._last_decrease > self.latency:
+                self.limit = max(
+                    settings.PAGING_MIN_CONCURRENCY, self.limit * settings.PAGING_BACKOFF_FACTOR
+                )
+                self._last_decrease = now
+        else:
+            self.limit = min(settings.PAGING_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+
+        _paging_limits[self.endpoint] = self.limit
+
+    async def fetch(self, url):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+        limiter = get_rate_limiter(url)
+        throttle_count = limiter.throttle_count
+        start = time.monotonic()
+        try:
+            data = await get_with_retry(url)
+            self._record(time.monotonic() - start, limiter.throttle_count > throttle_count)
+            return data
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        return {
+            "concurrency": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+        }
+
+
+def get_paging_concurrency(endpoint):
+    return AdaptiveConcurrency(endpoint, _paging_limits.get(endpoint))
+
+
+@contextlib.contextmanager
+def paging_concurrency(endpoint):
+    """
+    An `AdaptiveConcurrency` for `endpoint`, reported by `get_paging_stats` while it is in use.
+    """
+    concurrency = get_paging_concurrency(endpoint)
+    _paging_controllers[id(concurrency)] = concurrency
+    try:
+        yield concurrency
+    finally:
+        del _paging_controllers[id(concurrency)]
+
+
+def get_paging_endpoint(url):
+    """
+    Paging concurrency is learned per kind of endpoint (`logs`, `contributors`, `wikis`...) rather
+    than per registration, so key it on the last segment of the path.
+    """
+    return next((part for part in reversed(URL(url).path.split("/")) if part), "")
+
+
+def get_paging_stats():
+    """
+    Current concurrency, pages in flight and smoothed page latency for every endpoint being paged,
+    and the concurrency the next job will start from for endpoints that aren't.
+    """
+    stats = {
+        endpoint: {"concurrency": round(limit, 2), "in_flight": 0, "latency_ms": None}
+        for endpoint, limit in list(_paging_limits.items())
+    }
+    for controller in list(_paging_controllers.values()):
+        stats[controller.endpoint] = controller.stats()
+    return stats
+
+
+async def get_pages(url, page, parse_json=None, concurrency=None):
+    url = str(URL(url).update_query(page=page))
+    if concurrency is None:
+        data = await get_with_retry(url)
     else:
-        async with semaphore:
-            data = await get_with_retry(url, retry_on=(429,))
+        data = await concurrency.fetch(url)  # frees its slot before we enrich the page
+
+    return await enrich_page(data, parse_json)
 
-    result[page] = data["data"]
 
+async def enrich_page(data, parse_json=None):
     if parse_json:
-        result[page] = parse_json(data)["data"]
+        data = await parse_json(data)
+    return data["data"]
+
+
+async def iter_pages(url, first_page, parse_json=None):
+    """
+    Yields the data of every page of a paginated response in page order, starting with the
+    already fetched `first_page`. Later pages are fetched concurrently under the endpoint's
+    `AdaptiveConcurrency`, but never more than `PAGING_MAX_BUFFERED_PAGES` ahead of the page being
+    consumed, so memory stays bounded however many pages there are.
+
+    Every page, the first included, is passed through `parse_json` as soon as it arrives, so
+    enriching one page overlaps with downloading the next.
+    """
+    total = first_page["links"].get("meta", {}).get("total") or first_page["meta"].get("total")
+    per_page = first_page["links"].get("meta", {}).get("per_page") or first_page["meta"].get(
+        "per_page"
+    )
+    pages = math.ceil(int(total) / int(per_page))
+
+    with paging_concurrency(get_paging_endpoint(url)) as concurrency:
+        tasks = {1: asyncio.ensure_future(enrich_page(first_page, parse_json))}
+        next_page = 2
+        try:
+            for page in range(1, pages + 1):
+                while next_page <= pages and next_page - page < settings.PAGING_MAX_BUFFERED_PAGES:
+                    tasks[next_page] = asyncio.ensure_future(
+                        get_pages(url, next_page, parse_json=parse_json, concurrency=concurrency)
+                    )
+                    next_page += 1
+                yield await tasks.pop(page)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+
+async def get_first_page(url, parse_json=None):
+    """
+    Fetches `url`, returning the response and whether there are more pages of it. Unpaginated
+    responses are passed through `parse_json` here, paginated ones are left for `iter_pages`.
+    """
+    data = await get_with_retry(url)
+    is_paginated = bool(data.get("links", {}).get("next"))
+
+    if parse_json and not is_paginated:
+        data = await parse_json(data)
+
+    return data, is_paginated
+
+
+# user id -> names of the user's affiliated institutions
+_institutions_cache = TTLCache(settings.INSTITUTION_CACHE_SIZE, settings.INSTITUTION_CACHE_TTL)
 
-    return result
 
+async def get_user_institutions(user_data, concurrency):
+    institutions = _institutions_cache.get(user_data["id"])
+    if institutions is None:
+        institution_url = user_data["relationships"]["institutions"]["links"]["related"]["href"]
+        data = await concurrency.fetch(institution_url)
+        institutions = [institution["attributes"]["name"] for institution in data["data"]]
+        _institutions_cache.set(user_data["id"], institutions)
+    return list(institutions)
 
-async def get_additional_contributor_info(response):
-    contributor_data_list = []
-    for contributor in response["data"]:
+
+async def get_additional_contributor_info(response, concurrency):
+    """
+    Adds each contributor's affiliated institutions to a page of contributors, looking them up
+    concurrently and reusing lookups cached by earlier jobs.
+    :param concurrency: `AdaptiveConcurrency` shared by the lookups for every page of the job
+    """
+
+    async def add_contributor_info(contributor):
         contributor_data = {}
         errors = contributor["embeds"]["users"].get('errors')
         if errors and errors[0]['detail'] == 'The requested user is no longer available.':
             contributor_data = errors[0]['meta']
         else:
-            embed_data = contributor["embeds"]["users"]["data"]
-            institution_url = embed_data["relationships"]["institutions"]["links"][
-                "related"
-            ]["href"]
-            data = await get_with_retry(institution_url)
-            institution_data = data["data"]
-            institution_list = [
-                institution["attributes"]["name"] for institution in institution_data
-            ]
-            contributor_data["affiliated_institutions"] = institution_list
+            contributor_data["affiliated_institutions"] = await get_user_institutions(
+                contributor["embeds"]["users"]["data"], concurrency
+            )
 
         contributor.update(contributor_data)
-        contributor_data_list.append(contributor)
-    response["data"] = contributor_data_list
+        return contributor
+
+    response["data"] = await asyncio.gather(*map(add_contributor_info, response["data"]))
     return response
 
 
+async def dump_contributors_to_dir(guid, to_dir):
+    """
+    Writes the registration's contributors to `to_dir/contributors.json` with their institutions,
+    which are looked up under one `AdaptiveConcurrency` however many pages are enriched at once.
+    """
+    with paging_concurrency("institutions") as concurrency:
+        await dump_json_to_dir(
+            from_url=get_contributors_url(guid),
+            to_dir=to_dir,
+            name="contributors.json",
+            parse_json=partial(get_additional_contributor_info, concurrency=concurrency),
+        )
+
+
 async def get_paginated_data(url, parse_json=None):
-    data = await get_with_retry(url, retry_on=(429,))
-    tasks = []
-    is_paginated = data.get("links", {}).get("next")
+    data, is_paginated = await get_first_page(url, parse_json)
+    if not is_paginated:
+        return data
 
-    if parse_json:
-        data = await parse_json(data)
+    pages_as_list = []
+    pages = iter_pages(url, data, parse_json)
+    try:
+        async for page in pages:
+            pages_as_list += page
+    finally:
+        await pages.aclose()
+    return pages_as_list
 
-    if is_paginated:
-        paging_semaphore = asyncio.Semaphore(settings.PAGING_SEMAPHORE)
-        result = {1: data["data"]}
-        total = data["links"].get("meta", {}).get("total") or data["meta"].get("total")
-        per_page = data["links"].get("meta", {}).get("per_page") or data["meta"].get(
-            "per_page"
-        )
 
-        pages = math.ceil(int(total) / int(per_page))
-        for i in range(1, pages):
-            task = get_pages(url, i + 1, result=result, semaphore=paging_semaphore)
-            tasks.append(task)
+_ia_session = None
+_ia_session_lock = threading.Lock()
 
-        await asyncio.gather(*tasks)
-        pages_as_list = []
-        # through the magic of async all our pages have loaded.
-        for page in list(result.values()):
-            pages_as_list += page
-        return pages_as_list
-    else:
-        return data
+# IA identifier -> item metadata, as `session.get_item` fetches it
+_ia_item_cache = TTLCache(settings.IA_ITEM_CACHE_SIZE, settings.IA_ITEM_CACHE_TTL)
+
+
+def get_ia_session():
+    """
+    The process-wide IA session, shared by every "ia" executor thread. Its connection pools
+    (urllib3's, which are thread-safe) keep up to `IA_POOL_SIZE` connections to archive.org and
+    `IA_WORKERS` to IA's S3 API alive for every thread to reuse. Sharing one `requests.Session`
+    between threads is safe as it is only configured here: afterwards the only state requests
+    touches is the connection pools and the cookie jar, which locks itself, and `Item.upload`
+    doesn't remount adapters the way `Item.download` does.
+
+    Only archive.org gets `internetarchive`'s retrying adapter. IA's S3 API has its own retry
+    workflow (`Item.upload`'s `retries` and `retries_sleep`), which urllib3 resending a whole
+    upload on a 503 straight away would skip.
+    """
+    global _ia_session
+    with _ia_session_lock:
+        if _ia_session is None:
+            session = internetarchive.get_session(
+                config={
+                    "s3": {"access": settings.IA_ACCESS_KEY, "secret": settings.IA_SECRET_KEY},
+                },
+                http_adapter_kwargs={"pool_maxsize": settings.IA_POOL_SIZE},
+            )
+            session.headers.pop("Connection", None)  # internetarchive closes every connection
+            s3_url = urlparse(settings.IA_S3_URL)
+            session.mount(
+                f"{s3_url.scheme}://{s3_url.netloc}",
+                HTTPAdapter(pool_maxsize=settings.IA_WORKERS, max_retries=0),
+            )
+            _ia_session = session
+        return _ia_session
 
 
 def get_ia_item(guid):
-    session = internetarchive.get_session(
-        config={
-            "s3": {"access": settings.IA_ACCESS_KEY, "secret": settings.IA_SECRET_KEY},
-        },
-    )
-    return session.get_item(guid)
+    """
+    Returns the IA item, fetching its metadata only if it hasn't been fetched in the last
+    `IA_ITEM_CACHE_TTL` seconds.
+    """
+    session = get_ia_session()
+    item_metadata = _ia_item_cache.get(guid)
+    if item_metadata is not None:
+        return session.get_item(guid, item_metadata=copy.deepcopy(item_metadata))
+
+    ia_item = session.get_item(guid)
+    if ia_item.item_metadata:  # items that don't exist yet aren't cached
+        _ia_item_cache.set(guid, copy.deepcopy(ia_item.item_metadata))
+    return ia_item
 
 
-def sync_metadata(guid, metadata):
+class MetadataSyncError(Exception):
+    """
+    IA's Metadata API refused a metadata write.
     """
-    This is used to sync the metadata of archive.org items with OSF Registrations.
-    synced is as follows:
-        - title
-        - description
-        - date
-        - category
-        - subjects
-        - tags
-        - affiliated_institutions
-        - license
-        - article_doi
 
-    `moderation_state` is an allowable key, but only to determine a withdrawal status of a
-     registration.
-    :param guid:
-    :param metadata:
-    :return:
+
+def prepare_metadata_write(ia_item, metadata):
     """
+    Prepares a Metadata API write setting every key in `metadata` to its new value as a whole.
+    `ia_item.modify_metadata` diffs against the item's metadata instead, patching lists index by
+    index, which corrupts them when that metadata is a stale cached copy.
+    """
+    patch = [
+        # an add on a member that is already there replaces it
+        {"op": "add", "path": f"/{key}", "value": normalize_ia_value(value)}
+        for key, value in metadata.items()
+    ]
+    session = ia_item.session
+    return requests.Request(
+        "POST",
+        f"{session.protocol}//{session.host}/metadata/{ia_item.identifier}",
+        headers=session.headers.copy(),
+        data={"-patch": json.dumps(patch), "-target": "metadata", "priority": -5},
+        auth=S3PostAuth(session.access_key, session.secret_key),
+    ).prepare()
+
+
+def modify_ia_metadata(ia_item, metadata):
+    """
+    `ia_item.modify_metadata(metadata)`, but replacing each key whole (see
+    `prepare_metadata_write`) and without the full metadata fetch `internetarchive` follows every
+    write with. If IA takes the change it is applied to the item and the cached metadata instead,
+    otherwise the cached metadata is dropped and `MetadataSyncError` raised with IA's reason.
+    :return: the Metadata API's response
+    """
+    resp = ia_item.session.send(prepare_metadata_write(ia_item, metadata))
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {}
+
+    if not (resp.ok and body.get("success")):
+        _ia_item_cache.pop(ia_item.identifier)
+        raise MetadataSyncError(
+            f"Metadata write to {ia_item.identifier} failed ({resp.status_code}): "
+            f"{body.get('error') or resp.text}"
+        )
+    ia_item.item_metadata.setdefault("metadata", {}).update(metadata)
+    ia_item.metadata = ia_item.item_metadata["metadata"]
+    _ia_item_cache.set(ia_item.identifier, copy.deepcopy(ia_item.item_metadata))
+    return resp
+
 
+def normalize_ia_value(value):
+    """
+    A metadata value as IA stores it, for comparing: strings, with lists of one value stored as
+    just that value and empty values not stored at all.
+    """
+    if isinstance(value, (list, tuple)):
+        values = [normalize_ia_value(item) for item in value]
+        values = [item for item in values if item]
+        if len(values) <= 1:
+            return values[0] if values else ""
+        return values
+    if isinstance(value, bool):
+        return str(value).lower()
+    if value is None:
+        return ""
+    return str(value)
+
+
+def validate_metadata(metadata):
+    """
+    Raises `PayloadEncodingError` unless `metadata` is a metadata update `sync_metadata` accepts.
+    :param metadata:
+    """
     if not metadata:
         raise http_exceptions.PayloadEncodingError(
             "Metadata Payload not included in request"
         )
+    if not isinstance(metadata, dict):
+        raise http_exceptions.PayloadEncodingError("Metadata payload must be a json object")
 
     valid_updatable_metadata_keys = [
         "title",
@@ -352,38 +1682,348 @@ def sync_metadata(guid, metadata):
             f" not included in valid keys: `{', '.join(valid_updatable_metadata_keys)}`.",
         )
 
+
+WITHDRAWN_NOTE = "Note this registration has been withdrawn: \n"
+WITHDRAWN_DESCRIPTION = "This registration has been withdrawn"
+
+
+def sync_metadata(guid, metadata):
+    """
+    This is used to sync the metadata of archive.org items with OSF Registrations.
+    synced is as follows:
+        - title
+        - description
+        - date
+        - category
+        - subjects
+        - tags
+        - affiliated_institutions
+        - license
+        - article_doi
+
+    `moderation_state` is an allowable key, but only to determine a withdrawal status of a
+     registration.
+
+    Keys whose values IA already has are left out, and if nothing changed nothing is written.
+    Raises `MetadataSyncError` if IA refuses the write.
+    :param guid:
+    :param metadata:
+    :return: the IA item and the keys that were written
+    """
+    validate_metadata(metadata)
+
     item_name = settings.REG_ID_TEMPLATE.format(guid=guid)
     ia_item = get_ia_item(item_name)
-    if not metadata.get("withdrawal_justification"):  # withdrawn == not searchable
-        ia_item.modify_metadata(metadata)
-    else:
+    if metadata.get("withdrawal_justification"):  # withdrawn == not searchable
         description = ia_item.metadata.get("description")
-        if description:
-            metadata[
-                "description"
-            ] = f"Note this registration has been withdrawn: \n{description}"
+        if not description:
+            metadata["description"] = WITHDRAWN_DESCRIPTION
+        elif description.startswith(WITHDRAWN_NOTE) or description == WITHDRAWN_DESCRIPTION:
+            metadata["description"] = description  # already noted by an earlier sync
         else:
-            metadata["description"] = "This registration has been withdrawn"
+            metadata["description"] = f"{WITHDRAWN_NOTE}{description}"
+        metadata["noindex"] = True
+
+    # every write queues a catalog task on archive.org, so only write what changed, all at once
+    changes = {
+        key: value
+        for key, value in metadata.items()
+        if normalize_ia_value(value) != normalize_ia_value(ia_item.metadata.get(key))
+    }
+    if changes:
+        modify_ia_metadata(ia_item, changes)
+
+    return ia_item, list(changes.keys())
+
+
+class MetadataSyncQueue:
+    """
+    Coalesces the metadata updates osf.io sends for each guid. The first update for a guid opens a
+    `METADATA_SYNC_WINDOW` second window, every update sent within it is merged into it (a later
+    value for a key replaces an earlier one) and when it closes all of them are synced with one
+    `sync` call on `executor`. A guid's syncs run one at a time in the order their windows opened,
+    so an earlier update can never land after a later one.
+
+    Has to be used from a single event loop.
+    """
+
+    def __init__(self, sync, window=None, executor=None, callbacks=()):
+        self.sync = sync
+        self.window = settings.METADATA_SYNC_WINDOW if window is None else window
+        self.executor = executor
+        self.callbacks = callbacks  # added to every sync's future
+        self._pending = {}  # guid -> (merged metadata, future of its sync)
+        self._latest = {}  # guid -> task running the guid's latest sync
+
+    def submit(self, guid, metadata, window=None):
+        """
+        Queues `metadata` for `guid`'s next sync, raising `PayloadEncodingError` straight away if it
+        is invalid so it can't fail the updates it would be merged with.
+        :param window: overrides `self.window` if this opens a new window
+        :return: future of the `sync` call that will include `metadata`
+        """
+        validate_metadata(metadata)
+        if guid in self._pending:
+            merged, future = self._pending[guid]
+            merged.update(metadata)
+            return future
+
+        future = asyncio.get_running_loop().create_future()
+        for callback in self.callbacks:
+            future.add_done_callback(callback)
+        self._pending[guid] = (dict(metadata), future)
+
+        window = self.window if window is None else window
+        task = asyncio.ensure_future(self._run(guid, self._latest.get(guid), window))
+        self._latest[guid] = task
+        task.add_done_callback(partial(self._forget, guid))
+        return future
+
+    def _forget(self, guid, task):
+        if self._latest.get(guid) is task:
+            del self._latest[guid]
+
+    async def _run(self, guid, previous, window):
+        await asyncio.sleep(window)
+        if previous is not None:
+            await asyncio.wait([previous])
+        metadata, future = self._pending.pop(guid)
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.sync, guid, metadata
+            )
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+
+async def sync_metadata_bulk(queue, updates, concurrency=None):
+    """
+    Syncs every update from `updates` through `queue`, so they are ordered with any other updates
+    to the same registrations, `BULK_METADATA_CONCURRENCY` at a time. Updates are read as they are
+    needed, so `updates` can be streamed.
+    :param queue: `MetadataSyncQueue`
+    :param updates: async iterable of (guid, metadata), where metadata may be an exception for an
+        update that couldn't be read, which is reported as its result
+    :return: async generator of (guid, result) in the order they finish, where result is
+        `{"updated": [keys]}` or `{"error": message}`
+    """
+    concurrency = concurrency or settings.BULK_METADATA_CONCURRENCY
+
+    async def sync(guid, metadata):
+        if isinstance(metadata, Exception):
+            return guid, {"error": str(metadata)}
+        try:
+            _, updated = await queue.submit(guid, metadata, window=0)
+        except Exception as e:
+            return guid, {"error": str(e)}
+        return guid, {"updated": updated}
+
+    pending = set()
+    async for guid, metadata in updates:
+        while len(pending) >= concurrency:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+        pending.add(asyncio.ensure_future(sync(guid, metadata)))
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+
+class MultipartUploadError(Exception):
+    """
+    IA's S3 API refused to assemble a multipart upload.
+    """
+
+
+def get_ia_s3_headers(metadata=None):
+    """
+    Headers for IA's S3 API, with `metadata` turned into the headers that create and describe the
+    item the way `internetarchive` does for `Item.upload`.
+    """
+    headers = {"Authorization": f"LOW {settings.IA_ACCESS_KEY}:{settings.IA_SECRET_KEY}"}
+    if metadata is not None:
+        request = S3PreparedRequest()
+        request.prepare_headers({}, dict(metadata))
+        headers.update(request.headers)
+    return headers
+
+
+async def _ia_s3_request(method, url, headers=None, timeout=None, **kwargs):
+    limiter = get_rate_limiter(url)
+    async with limiter:
+        async with get_session().request(
+            method,
+            url,
+            headers={**get_ia_s3_headers(), **(headers or {})},
+            timeout=timeout or ClientTimeout(total=settings.IA_UPLOAD_PART_TIMEOUT),
+            **kwargs,
+        ) as resp:
+            raise_for_status(resp, limiter)
+            return resp.headers, await resp.text()
+
+
+async def get_multipart_upload(item_name, key):
+    """
+    Finds an unfinished multipart upload of `key` to `item_name` left by an earlier attempt.
+    :return: (upload id, {part number: ETag of every part IA acknowledged}), or (None, {})
+    """
+    try:
+        _, body = await retry(
+            _ia_s3_request, "GET", f"{settings.IA_S3_URL}{item_name}?uploads&prefix={quote(key)}"
+        )
+    except ClientResponseError as e:
+        if e.status != 404:  # anything but the item not existing yet would orphan the old parts
+            raise
+        logger.info(f"No multipart uploads to resume for {item_name}, it doesn't exist yet")
+        return None, {}
+
+    upload_ids = [
+        upload.findtext("{*}UploadId")
+        for upload in ET.fromstring(body).iterfind(".//{*}Upload")
+        if upload.findtext("{*}Key") == key
+    ]
+    if not upload_ids:
+        return None, {}
+
+    upload_id = upload_ids[-1]
+    parts = {}
+    marker = 0
+    while True:
+        _, body = await retry(
+            _ia_s3_request,
+            "GET",
+            f"{settings.IA_S3_URL}{item_name}/{quote(key)}"
+            f"?uploadId={upload_id}&part-number-marker={marker}",
+        )
+        listing = ET.fromstring(body)
+        for part in listing.iterfind(".//{*}Part"):
+            parts[int(part.findtext("{*}PartNumber"))] = part.findtext("{*}ETag").strip('"')
+        if listing.findtext("{*}IsTruncated") != "true":
+            return upload_id, parts
+        marker = listing.findtext("{*}NextPartNumberMarker")
+
+
+def md5_file_range(path, offset, size):
+    md5 = hashlib.md5()
+    with open(path, "rb") as fp:
+        fp.seek(offset)
+        while size > 0:
+            block = fp.read(min(settings.BAG_HASH_CHUNK_SIZE, size))
+            if not block:
+                break
+            md5.update(block)
+            size -= len(block)
+    return md5
+
+
+async def iter_file_range(path, offset, size):
+    """
+    Yields `size` bytes of `path` from `offset`, read on the "read" executor.
+    """
+    with open(path, "rb", buffering=0) as fp:
+        fp.seek(offset)
+        while size > 0:
+            block = await run_blocking("read", fp.read, min(settings.WRITE_CHUNK_SIZE, size))
+            if not block:
+                raise EOFError(f"{path} ended {size} bytes early")
+            size -= len(block)
+            yield block
+
+
+async def _upload_part(url, upload_id, number, path, offset, size, md5):
+    headers, _ = await _ia_s3_request(
+        "PUT",
+        f"{url}?partNumber={number}&uploadId={upload_id}",
+        headers={
+            "Content-Length": str(size),
+            "Content-MD5": base64.b64encode(md5.digest()).decode(),
+        },
+        data=iter_file_range(path, offset, size),
+    )
+    return headers["ETag"].strip('"')
 
-        ia_item.modify_metadata(metadata)
-        ia_item.modify_metadata({"noindex": True})
 
-    return ia_item, list(metadata.keys())
+async def multipart_upload(item_name, path, metadata):
+    """
+    Uploads `path` to `item_name` with an S3 multipart upload, `IA_UPLOAD_CONCURRENCY` parts of
+    `IA_UPLOAD_PART_SIZE` at a time over the event loop's pooled session, each retried on its own.
+    If an earlier attempt left an unfinished upload of the file, parts IA already has (the ETag of
+    a part is its MD5) aren't sent again.
+    :param metadata: IA item metadata, as for `Item.upload`
+    """
+    key = os.path.basename(path)
+    url = f"{settings.IA_S3_URL}{item_name}/{quote(key)}"
+    size = os.path.getsize(path)
+    part_size = max(settings.IA_UPLOAD_PART_SIZE, math.ceil(size / 10000))  # S3's part limit
+    parts = {
+        number: (offset, min(part_size, size - offset))
+        for number, offset in enumerate(range(0, size, part_size), start=1)
+    }
+
+    upload_id, uploaded = await get_multipart_upload(item_name, key)
+    if upload_id is None:
+        _, body = await retry(
+            _ia_s3_request, "POST", f"{url}?uploads", headers=get_ia_s3_headers(metadata)
+        )
+        upload_id = ET.fromstring(body).findtext("{*}UploadId")
+    else:
+        logger.info(f"Resuming upload {upload_id} of {url}, {len(uploaded)} parts acknowledged")
+
+    semaphore = asyncio.Semaphore(settings.IA_UPLOAD_CONCURRENCY)
+
+    async def upload_part(number):
+        offset, part_size = parts[number]
+        async with semaphore:
+            md5 = await run_blocking("read", md5_file_range, path, offset, part_size)
+            if uploaded.get(number) == md5.hexdigest():
+                return md5.hexdigest()
+            return await retry(_upload_part, url, upload_id, number, path, offset, part_size, md5)
+
+    etags = await asyncio.gather(*map(upload_part, parts))
+
+    complete = "".join(
+        f"<Part><PartNumber>{number}</PartNumber><ETag>\"{etag}\"</ETag></Part>"
+        for number, etag in zip(parts, etags)
+    )
+    _, body = await retry(
+        _ia_s3_request,
+        "POST",
+        f"{url}?uploadId={upload_id}",
+        data=f"<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>".encode(),
+    )
+    result = ET.fromstring(body)
+    if result.tag.rsplit("}", 1)[-1] == "Error":  # S3 can fail a completion after a 200
+        raise MultipartUploadError(f"{url}: {result.findtext('{*}Message')}")
 
 
 async def upload(item_name, temp_dir, metadata):
-    ia_item = get_ia_item(item_name)
+    ia_item = await run_blocking("ia", get_ia_item, item_name)
     ia_metadata = await get_metadata_for_ia_item(metadata)
     provider_id = metadata["data"]["embeds"]["provider"]["data"]["id"]
-    ia_item.upload(
-        os.path.join(temp_dir, "bag.zip"),
-        metadata={
-            "collection": settings.PROVIDER_ID_TEMPLATE.format(provider_id=provider_id),
-            **ia_metadata,
-        },
-        access_key=settings.IA_ACCESS_KEY,
-        secret_key=settings.IA_SECRET_KEY,
-    )
+    ia_metadata = {
+        "collection": settings.PROVIDER_ID_TEMPLATE.format(provider_id=provider_id),
+        **ia_metadata,
+    }
+    path = os.path.join(temp_dir, "bag.zip")
+    try:
+        if os.path.getsize(path) >= settings.IA_MULTIPART_THRESHOLD:
+            await multipart_upload(item_name, path, ia_metadata)
+        else:
+            await run_blocking(
+                "ia",
+                ia_item.upload,
+                path,
+                metadata=ia_metadata,
+                access_key=settings.IA_ACCESS_KEY,
+                secret_key=settings.IA_SECRET_KEY,
+            )
+    finally:
+        _ia_item_cache.pop(item_name)
     return ia_item
 
 
@@ -401,16 +2041,19 @@ async def get_registration_metadata(guid, temp_dir, filename):
     if metadata["data"]["attributes"]["withdrawn"]:
         raise PermissionError(f"Registration {guid} is withdrawn")
 
-    with open(os.path.join(temp_dir, filename), "w") as fp:
-        json.dump(metadata, fp)
+    async with open_async(os.path.join(temp_dir, filename), payload=True) as fp:
+        await fp.write(json.dumps(metadata))
 
     return metadata
 
 
 async def archive(guid):
-    with tempfile.TemporaryDirectory(
+    start_job_requests()
+    _job_payload.set({})
+    temp_dir = tempfile.mkdtemp(
         dir=settings.PIGEON_TEMP_DIR, prefix=settings.REG_ID_TEMPLATE.format(guid=guid)
-    ) as temp_dir:
+    )
+    try:
         os.mkdir(os.path.join(temp_dir, "bag"))
         # await first to check if withdrawn
         metadata = await get_registration_metadata(
@@ -430,13 +2073,7 @@ async def archive(guid):
                 to_dir=os.path.join(temp_dir, "bag"),
                 name="logs.json",
             ),
-            dump_json_to_dir(
-                from_url=f"{settings.OSF_API_URL}v2/registrations/{guid}/contributors/"
-                f"?page[size]=100",
-                to_dir=os.path.join(temp_dir, "bag"),
-                name="contributors.json",
-                parse_json=get_additional_contributor_info,
-            ),
+            dump_contributors_to_dir(guid, os.path.join(temp_dir, "bag")),
             dump_json_to_dir(
                 from_url=f"{settings.OSF_API_URL}v2/registrations/{guid}/schema_responses/"
                 f"?page[size]=100",
@@ -453,7 +2090,11 @@ async def archive(guid):
         file_count = metadata["data"]["relationships"]["files"]["links"]["related"][
             "meta"
         ]["count"]
-        if file_count:
+        if file_count and settings.FILES_DOWNLOAD_MODE == "files":
+            tasks.append(
+                download_files_to_dir(guid, os.path.join(temp_dir, "bag", "archived_files"))
+            )
+        elif file_count:
             tasks.append(
                 stream_files_to_dir(
                     f"{settings.OSF_FILES_URL}v1/resources/{guid}/providers/osfstorage/?zip=",
@@ -475,18 +2116,86 @@ async def archive(guid):
 
         await asyncio.gather(*tasks)
 
-        # bagit changes the cwd so set it here again in case it crashed before changing it back.
-        os.chdir(temp_dir)
-        bagit.make_bag(os.path.join(temp_dir, "bag"))
-        bag = bagit.Bag(os.path.join(temp_dir, "bag"))
-        assert bag.is_valid()
+        await run_blocking("bag", build_bag, os.path.join(temp_dir, "bag"), _job_payload.get())
+        await run_blocking(
+            "bag", validate_bag, os.path.join(temp_dir, "bag"), _job_payload.get()
+        )
 
-        create_zip(temp_dir)
+        await run_blocking("bag", create_zip, temp_dir)
         ia_item = await upload(
             settings.REG_ID_TEMPLATE.format(guid=guid), temp_dir, metadata
         )
 
         return ia_item, guid
+    finally:
+        # a bag.zip can be many GB, deleting it mustn't hold up the event loop
+        await run_blocking("bag", shutil.rmtree, temp_dir, True)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """
+    Bounded thread pools for the blocking steps of archive jobs, shared by every job in the
+    process: "bag" builds, validates and zips bags on `BAG_WORKERS` threads, "ia" talks to
+    Internet Archive on `IA_WORKERS` threads, "write" writes files for `AsyncWriter` and reads
+    and writes the `HTTPCache` on `WRITE_WORKERS` threads and "read" reads and hashes the parts of
+    multipart uploads on `READ_WORKERS` threads, so blocking IA calls can't hold them up. Metadata
+    syncs run on "metadata"'s `METADATA_WORKERS` threads, so a bulk re-sync can't hold up uploads.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            max_workers = {
+                "bag": settings.BAG_WORKERS,
+                "ia": settings.IA_WORKERS,
+                "write": settings.WRITE_WORKERS,
+                "read": settings.READ_WORKERS,
+                "metadata": settings.METADATA_WORKERS,
+            }[name]
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"pigeon_{name}"
+            )
+        return _executors[name]
+
+
+async def run_blocking(executor, func, *args, **kwargs):
+    """
+    Runs `func` on the `executor` pool (see `get_executor`) so it doesn't hold up the event loop,
+    in a copy of the caller's context so per-job state is still visible to it.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(executor), partial(context.run, func, *args, **kwargs)
+    )
+
+
+# Caps the archive jobs running at once on each event loop.
+_job_slots = weakref.WeakKeyDictionary()
+
+
+async def run_job(coroutine):
+    """
+    Runs an archive job on the running event loop, where it shares the connection pool, caches and
+    rate limiters with every other job. Waits while `MAX_ARCHIVE_JOBS` jobs are already running.
+    :param coroutine: e.g. `archive(guid)`
+    :return: the job's result
+    """
+    loop = asyncio.get_running_loop()
+    slots = _job_slots.get(loop)
+    if slots is None:
+        slots = _job_slots[loop] = asyncio.Semaphore(settings.MAX_ARCHIVE_JOBS)
+    try:
+        await slots.acquire()
+    except BaseException:
+        coroutine.close()  # cancelled while queued, the job never started
+        raise
+    try:
+        return await coroutine
+    finally:
+        slots.release()
 
 
 def run(coroutine):
@@ -496,7 +2205,86 @@ def run(coroutine):
         return loop.run_until_complete(coroutine)
     finally:
         try:
+            loop.run_until_complete(close_session())
             loop.run_until_complete(loop.shutdown_asyncgens())
         finally:
             events.set_event_loop(None)
             loop.close()
+
+
+class ArchiveWorkerError(Exception):
+    """
+    Stands in for an exception raised in an archive worker process that can't be pickled back to
+    the app, carrying its traceback as the message.
+    """
+
+
+_archive_pool = None
+_archive_pool_lock = threading.Lock()
+
+
+def init_archive_worker(parent_settings):
+    """
+    Worker processes start with the parent's settings, each job gets a process to itself so it
+    hashes its payload in-process rather than starting a hash pool of its own. Every worker has its
+    own `RateLimiter`s, held to the `PROCESS_RATE_LIMIT_*` limits rather than the app-wide ones, see
+    the settings for what that gives up.
+    """
+    for key, value in parent_settings.items():
+        setattr(settings, key, value)
+    settings.BAG_HASH_PROCESSES = 1
+    settings.RATE_LIMIT_PER_SECOND = settings.PROCESS_RATE_LIMIT_PER_SECOND
+    settings.RATE_LIMIT_BURST = settings.PROCESS_RATE_LIMIT_BURST
+    settings.RATE_LIMIT_MAX_IN_FLIGHT = settings.PROCESS_RATE_LIMIT_MAX_IN_FLIGHT
+
+
+def get_archive_pool():
+    """
+    Process pool archive jobs run on when `ARCHIVE_WORKER_MODE` is "process", so the hashing,
+    zipping and JSON serialization of concurrent jobs scale across `ARCHIVE_PROCESSES` cores
+    instead of sharing the app's GIL. A broken pool is replaced, so one dead worker doesn't fail
+    every later job.
+    """
+    global _archive_pool
+    with _archive_pool_lock:
+        _archive_pool = discard_if_broken(_archive_pool)
+        if _archive_pool is None:
+            _archive_pool = ProcessPoolExecutor(
+                max_workers=settings.ARCHIVE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_archive_worker,
+                initargs=({key: getattr(settings, key) for key in dir(settings) if key.isupper()},),
+            )
+        return _archive_pool
+
+
+def submit_archive_job(guid):
+    """
+    Runs `archive_worker(guid)` on the archive pool.
+    :return: concurrent.futures.Future of its result
+    """
+    try:
+        return get_archive_pool().submit(archive_worker, guid)
+    except BrokenProcessPool:  # broke since get_archive_pool checked it
+        return get_archive_pool().submit(archive_worker, guid)
+
+
+def archive_worker(guid):
+    """
+    Runs `archive` in an archive pool process. The result must be pickled back to the app, so the
+    IA item is reduced to the attributes `archive_task_done` uses and exceptions that won't survive
+    the trip are replaced with an `ArchiveWorkerError`.
+    :return: (item, guid)
+    """
+    try:
+        ia_item, guid = run(archive(guid))
+    except Exception as e:
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            raise ArchiveWorkerError(traceback.format_exc()) from None
+        raise
+    item = SimpleNamespace(
+        identifier=ia_item.identifier, urls=SimpleNamespace(details=ia_item.urls.details)
+    )
+    return item, guid
@@ -7,6 +7,28 @@ OSF_BEARER_TOKEN = os.environ.get("OSF_BEARER_TOKEN")
 # New tokens can be found at https://archive.org/account/s3.php
 IA_ACCESS_KEY = os.environ.get("IA_ACCESS_KEY")
 IA_SECRET_KEY = os.environ.get("IA_SECRET_KEY")
+IA_S3_URL = os.environ.get("IA_S3_URL", "https://s3.us.archive.org/")
+# Bags of IA_MULTIPART_THRESHOLD bytes or more are uploaded as a multipart upload instead of one
+# PUT, IA_UPLOAD_CONCURRENCY parts of IA_UPLOAD_PART_SIZE at a time.
+IA_MULTIPART_THRESHOLD = int(os.environ.get('IA_MULTIPART_THRESHOLD', 256 * 1024 * 1024))
+IA_UPLOAD_PART_SIZE = int(os.environ.get('IA_UPLOAD_PART_SIZE', 64 * 1024 * 1024))
+IA_UPLOAD_CONCURRENCY = int(os.environ.get('IA_UPLOAD_CONCURRENCY', 4))
+IA_UPLOAD_PART_TIMEOUT = int(os.environ.get('IA_UPLOAD_PART_TIMEOUT', 900))
+# One IA session is shared by the process, keeping up to IA_POOL_SIZE connections to archive.org
+# (and IA_WORKERS to IA_S3_URL) alive, and item metadata is cached for IA_ITEM_CACHE_TTL seconds
+# between syncs.
+IA_POOL_SIZE = int(os.environ.get('IA_POOL_SIZE', 32))
+IA_ITEM_CACHE_SIZE = int(os.environ.get('IA_ITEM_CACHE_SIZE', 1000))
+IA_ITEM_CACHE_TTL = int(os.environ.get('IA_ITEM_CACHE_TTL', 60))
+# Metadata updates for a registration sent within this many seconds of each other are synced
+# together.
+METADATA_SYNC_WINDOW = float(os.environ.get('METADATA_SYNC_WINDOW', 2))
+# Updates sent to the bulk /metadata endpoint are synced this many at a time.
+BULK_METADATA_CONCURRENCY = int(os.environ.get('BULK_METADATA_CONCURRENCY', 16))
+# Lines of NDJSON sent to it over this many bytes are reported as errors and skipped.
+BULK_METADATA_MAX_LINE_SIZE = int(os.environ.get('BULK_METADATA_MAX_LINE_SIZE', 1024 * 1024))
+# Metadata syncs run on a pool of METADATA_WORKERS threads of their own.
+METADATA_WORKERS = int(os.environ.get('METADATA_WORKERS', 4))
 OSF_API_URL = os.environ.get("OSF_API_URL")
 OSF_FILES_URL = os.environ.get("OSF_FILES_URL")
 DATACITE_PREFIX = os.environ.get("DATACITE_PREFIX")
@@ -15,8 +37,108 @@ DOI_FORMAT = os.environ.get("DOI_FORMAT")
 OSF_COLLECTION_NAME = os.environ.get("OSF_COLLECTION_NAME")
 ID_VERSION = os.environ.get("ID_VERSION")
 MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 1))
+# Archive jobs run as tasks on the app's event loop, at most MAX_ARCHIVE_JOBS at once. Their
+# blocking steps are offloaded to shared thread pools, BAG_WORKERS threads for building, validating
+# and zipping bags and IA_WORKERS threads for Internet Archive calls.
+MAX_ARCHIVE_JOBS = int(os.environ.get('MAX_ARCHIVE_JOBS', 16))
+BAG_WORKERS = int(os.environ.get('BAG_WORKERS', os.cpu_count() or 1))
+IA_WORKERS = int(os.environ.get('IA_WORKERS', 8))
+# Files are written from the event loop in blocks of whole WRITE_CHUNK_SIZE chunks on
+# WRITE_WORKERS threads, with up to WRITE_BUFFER_SIZE bytes per file waiting on the disk.
+WRITE_CHUNK_SIZE = int(os.environ.get('WRITE_CHUNK_SIZE', 1024 * 1024))
+WRITE_BUFFER_SIZE = int(os.environ.get('WRITE_BUFFER_SIZE', 8 * 1024 * 1024))
+WRITE_WORKERS = int(os.environ.get('WRITE_WORKERS', 8))
+# Parts of multipart uploads are read and hashed on READ_WORKERS threads.
+READ_WORKERS = int(os.environ.get('READ_WORKERS', 8))
+# "process" runs each archive job in its own process from a pool of ARCHIVE_PROCESSES instead, so
+# CPU-bound stages of concurrent jobs aren't stuck on one core.
+ARCHIVE_WORKER_MODE = os.environ.get('ARCHIVE_WORKER_MODE', 'loop')
+ARCHIVE_PROCESSES = int(os.environ.get('ARCHIVE_PROCESSES', os.cpu_count() or 1))
 FILES_TIMEOUT = int(os.environ.get('FILES_TIMEOUT', 300))
-PAGING_SEMAPHORE = int(os.environ.get('PAGING_SEMAPHORE', 5))
+# "zip" streams OSF Storage as one zip from WaterButler, "files" downloads the files themselves,
+# FILES_DOWNLOAD_CONCURRENCY at a time, resuming any that are cut off.
+FILES_DOWNLOAD_MODE = os.environ.get('FILES_DOWNLOAD_MODE', 'zip')
+FILES_DOWNLOAD_CONCURRENCY = int(os.environ.get('FILES_DOWNLOAD_CONCURRENCY', 8))
+PAGING_SEMAPHORE = int(os.environ.get('PAGING_SEMAPHORE', 5))  # initial pages in flight
+# Paging concurrency adapts between these bounds, see pigeon.AdaptiveConcurrency.
+PAGING_MIN_CONCURRENCY = int(os.environ.get('PAGING_MIN_CONCURRENCY', 1))
+PAGING_MAX_CONCURRENCY = int(os.environ.get('PAGING_MAX_CONCURRENCY', 32))
+PAGING_LATENCY_TOLERANCE = float(os.environ.get('PAGING_LATENCY_TOLERANCE', 2))
+PAGING_BACKOFF_FACTOR = float(os.environ.get('PAGING_BACKOFF_FACTOR', 0.5))
+# How far ahead of the page being written out pages may be fetched.
+PAGING_MAX_BUFFERED_PAGES = int(os.environ.get('PAGING_MAX_BUFFERED_PAGES', 64))
+
+# Checksums for bag manifests, the payload is hashed with these as it is written.
+BAG_CHECKSUMS = os.environ.get('BAG_CHECKSUMS', 'sha256,sha512').split(',')
+# Payload that wasn't hashed as it was written is hashed across this many processes, files over
+# BAG_HASH_THREADED_SIZE also get a thread per checksum algorithm. Off (1) by default until its
+# scaling with core count has been measured on a multi-core host.
+BAG_HASH_PROCESSES = int(os.environ.get('BAG_HASH_PROCESSES', 1))
+BAG_HASH_CHUNK_SIZE = int(os.environ.get('BAG_HASH_CHUNK_SIZE', 1024 * 1024))
+BAG_HASH_THREADED_SIZE = int(os.environ.get('BAG_HASH_THREADED_SIZE', 64 * 1024 * 1024))
+# Bags are validated against those write-time digests, re-hashing only a sample of the payload
+# unless full validation is turned on.
+BAG_FULL_VALIDATION = os.environ.get('BAG_FULL_VALIDATION', '').lower() in ('1', 'true')
+BAG_VALIDATION_SAMPLE_RATE = float(os.environ.get('BAG_VALIDATION_SAMPLE_RATE', 0))
+
+# bag.zip entries are deflated at this level, except already compressed files which are stored as
+# they are.
+ZIP_COMPRESSION_LEVEL = int(os.environ.get('ZIP_COMPRESSION_LEVEL', 6))
+ZIP_STORED_EXTENSIONS = [
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".zst", ".rar",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".mov", ".avi",
+]
+
+# Contributor institutions are cached per user for the life of the worker process.
+INSTITUTION_CACHE_SIZE = int(os.environ.get('INSTITUTION_CACHE_SIZE', 10000))
+INSTITUTION_CACHE_TTL = int(os.environ.get('INSTITUTION_CACHE_TTL', 3600))
+# DataCite XML metadata is cached per DOI the same way.
+DATACITE_CACHE_SIZE = int(os.environ.get('DATACITE_CACHE_SIZE', 1000))
+DATACITE_CACHE_TTL = int(os.environ.get('DATACITE_CACHE_TTL', 3600))
+
+# Responses from these endpoints are kept for the rest of an archive job once fetched, others are
+# only shared between requests that are in flight at the same time.
+JOB_MEMOIZED_ENDPOINTS = [
+    "contributors",
+    "institutions",
+    "subjects",
+    "children",
+    "identifiers",
+]
+
+# On-disk cache of OSF API responses revalidated with ETag/Last-Modified, disabled when unset.
+HTTP_CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', None)
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Responses from URLs matching these are served from the cache without revalidating.
+HTTP_CACHE_IMMUTABLE_URLS = [
+    r"/v2/schemas/",
+    r"/v2/providers/",
+]
+
+# Connection pooling for the shared aiohttp session, 0 means no limit.
+HTTP_POOL_LIMIT = int(os.environ.get('HTTP_POOL_LIMIT', 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get('HTTP_POOL_LIMIT_PER_HOST', 20))
+HTTP_DNS_CACHE_TTL = int(os.environ.get('HTTP_DNS_CACHE_TTL', 300))
+HTTP_KEEPALIVE_TIMEOUT = int(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 30))
+
+# Retry policy for OSF/WaterButler requests, backoff doubles from the base up to the max.
+RETRY_STATUSES = (429, 502, 503, 504)
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 8))
+RETRY_DEADLINE = int(os.environ.get('RETRY_DEADLINE', 900))
+RETRY_BACKOFF_BASE = float(os.environ.get('RETRY_BACKOFF_BASE', 1))
+RETRY_BACKOFF_MAX = float(os.environ.get('RETRY_BACKOFF_MAX', 60))
+
+# Process-wide limits per host shared by all archive jobs, a rate of 0 means unlimited.
+RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND', 10))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 10))
+RATE_LIMIT_MAX_IN_FLIGHT = int(os.environ.get('RATE_LIMIT_MAX_IN_FLIGHT', 20))
+# The "process" worker mode gives up both guarantees above: each of the ARCHIVE_PROCESSES workers
+# is held to these limits on its own, so a host can see up to ARCHIVE_PROCESSES times them, and a
+# 429's cool-down only pauses the worker that got it (the others back off once they get theirs).
+# They default to a fifth of the app-wide limits, so four or five busy workers stay near them.
+PROCESS_RATE_LIMIT_PER_SECOND = float(os.environ.get('PROCESS_RATE_LIMIT_PER_SECOND', 2))
+PROCESS_RATE_LIMIT_BURST = int(os.environ.get('PROCESS_RATE_LIMIT_BURST', 2))
+PROCESS_RATE_LIMIT_MAX_IN_FLIGHT = int(os.environ.get('PROCESS_RATE_LIMIT_MAX_IN_FLIGHT', 4))
 
 
 REG_ID_TEMPLATE = f"osf-registrations-{{guid}}-{ID_VERSION}"
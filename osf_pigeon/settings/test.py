@@ -14,10 +14,80 @@ DATACITE_PASSWORD = "test-datacite-password"
 
 IA_ACCESS_KEY = "Clyde Simmons is underrated"
 IA_SECRET_KEY = "Ben Simmons is overrated"
+IA_S3_URL = "https://s3.us.archive.org/"
+IA_MULTIPART_THRESHOLD = 256 * 1024 * 1024
+IA_UPLOAD_PART_SIZE = 64 * 1024 * 1024
+IA_UPLOAD_CONCURRENCY = 4
+IA_UPLOAD_PART_TIMEOUT = 900
+IA_POOL_SIZE = 4
+IA_ITEM_CACHE_SIZE = 100
+IA_ITEM_CACHE_TTL = 60
+METADATA_SYNC_WINDOW = 0.05
+BULK_METADATA_CONCURRENCY = 4
+BULK_METADATA_MAX_LINE_SIZE = 1024 * 1024
+METADATA_WORKERS = 2
 OSF_BEARER_TOKEN = "Temple U is rated"
+SENTRY_DSN = None
 
 REG_ID_TEMPLATE = f"osf-registrations-{{guid}}-{ID_VERSION}"
 PROVIDER_ID_TEMPLATE = f"osf-registration-providers-{{provider_id}}-{ID_VERSION}"
 
 PAGING_SEMAPHORE = 5
+PAGING_MIN_CONCURRENCY = 1
+PAGING_MAX_CONCURRENCY = 32
+PAGING_LATENCY_TOLERANCE = 2
+PAGING_BACKOFF_FACTOR = 0.5
+PAGING_MAX_BUFFERED_PAGES = 64
+MAX_WORKERS = 1
+MAX_ARCHIVE_JOBS = 16
+BAG_WORKERS = 2
+IA_WORKERS = 2
+WRITE_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+WRITE_WORKERS = 2
+READ_WORKERS = 2
+ARCHIVE_WORKER_MODE = "loop"
+ARCHIVE_PROCESSES = 1
 FILES_TIMEOUT = 300
+FILES_DOWNLOAD_MODE = "zip"
+FILES_DOWNLOAD_CONCURRENCY = 4
+PIGEON_TEMP_DIR = None
+
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 20
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 30
+
+RETRY_STATUSES = (429, 502, 503, 504)
+RETRY_MAX_ATTEMPTS = 3
+RETRY_DEADLINE = 10
+RETRY_BACKOFF_BASE = 0
+RETRY_BACKOFF_MAX = 0
+
+RATE_LIMIT_PER_SECOND = 0
+RATE_LIMIT_BURST = 1
+RATE_LIMIT_MAX_IN_FLIGHT = 20
+PROCESS_RATE_LIMIT_PER_SECOND = 0
+PROCESS_RATE_LIMIT_BURST = 1
+PROCESS_RATE_LIMIT_MAX_IN_FLIGHT = 20
+
+INSTITUTION_CACHE_SIZE = 100
+INSTITUTION_CACHE_TTL = 3600
+DATACITE_CACHE_SIZE = 100
+DATACITE_CACHE_TTL = 3600
+
+JOB_MEMOIZED_ENDPOINTS = ["contributors", "institutions", "subjects", "children", "identifiers"]
+
+HTTP_CACHE_DIR = None
+HTTP_CACHE_MAX_BYTES = 1024 * 1024
+HTTP_CACHE_IMMUTABLE_URLS = [r"/v2/schemas/", r"/v2/providers/"]
+
+BAG_CHECKSUMS = ["sha256", "sha512"]
+BAG_HASH_PROCESSES = 1
+BAG_HASH_CHUNK_SIZE = 1024 * 1024
+BAG_HASH_THREADED_SIZE = 64 * 1024 * 1024
+BAG_FULL_VALIDATION = False
+BAG_VALIDATION_SAMPLE_RATE = 0
+
+ZIP_COMPRESSION_LEVEL = 6
+ZIP_STORED_EXTENSIONS = [".zip", ".gz", ".png", ".jpg"]
@@ -1,23 +1,329 @@
 import os
+import re
+import time
 import json
+import shutil
+import pickle
+import asyncio
+import hashlib
+import zipfile
+import threading
+import bagit
+import mock
 import pytest
-from osf_pigeon import settings
+from aiohttp import ClientResponseError, http_exceptions, web
+from aiohttp.test_utils import TestClient, TestServer
+from datacite.errors import (
+    DataCiteNotFoundError,
+    DataCiteForbiddenError,
+    DataCiteServerError,
+)
+from osf_pigeon import settings, pigeon
+from conftest import get_stand_in_file
 
 import tempfile
+from functools import partial
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from osf_pigeon.pigeon import (
+    run,
+    run_job,
+    run_blocking,
+    archive,
+    archive_worker,
+    get_archive_pool,
+    get_hash_pool,
+    init_archive_worker,
+    ArchiveWorkerError,
+    RateLimiter,
+    HTTPCache,
+    AdaptiveConcurrency,
+    get_paging_stats,
+    get_session,
+    get_with_retry,
+    start_job_requests,
+    normalize_url,
+    parse_retry_after,
     stream_files_to_dir,
+    download_file,
+    FileIntegrityError,
     dump_json_to_dir,
     get_metadata_for_ia_item,
     get_additional_contributor_info,
+    dump_contributors_to_dir,
+    paging_concurrency,
     sync_metadata,
+    MetadataSyncError,
+    MetadataSyncQueue,
+    sync_metadata_bulk,
+    normalize_ia_value,
     upload,
+    multipart_upload,
+    get_multipart_upload,
     write_datacite_metadata,
+    open_async,
+    AsyncWriter,
+    build_bag,
+    validate_bag,
+    create_zip,
+    hash_file,
+    hash_files,
+    _institutions_cache,
+    _job_payload,
+    _datacite_cache,
+    _ia_item_cache,
 )
 from aioresponses import aioresponses
+from yarl import URL
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 
 
+@pytest.fixture
+def payload():
+    token = _job_payload.set({})
+    yield _job_payload.get()
+    _job_payload.reset(token)
+
+
+def sent_metadata_patches(ia_session):
+    """
+    The JSON patch of every Metadata API write sent through the mock IA session.
+    """
+    return [
+        json.loads(parse_qs(call.args[0].body)["-patch"][0])
+        for call in ia_session.send.call_args_list
+    ]
+
+
+class TestSession:
+    def test_session_reused_within_loop(self):
+        async def get_sessions():
+            return get_session(), get_session()
+
+        first, second = run(get_sessions())
+        assert first is second
+        assert first.closed  # run closes the loop's session on the way out
+
+    def test_session_per_loop(self):
+        async def get_open_session():
+            return get_session()
+
+        assert run(get_open_session()) is not run(get_open_session())
+
+
+@pytest.mark.asyncio
+class TestRetry:
+    @pytest.fixture
+    def url(self):
+        return f"{settings.OSF_API_URL}v2/registrations/guid0/"
+
+    async def test_retries_throttled_response(self, url):
+        with aioresponses() as m:
+            m.get(url, status=429, headers={"Retry-After": "0"})
+            m.get(url, status=503)
+            m.get(url, payload={"data": {"id": "guid0"}})
+            data = await get_with_retry(url)
+
+        assert data == {"data": {"id": "guid0"}}
+
+    async def test_gives_up_after_max_attempts(self, url):
+        with aioresponses() as m:
+            for _ in range(settings.RETRY_MAX_ATTEMPTS):
+                m.get(url, status=502)
+            with pytest.raises(ClientResponseError) as e:
+                await get_with_retry(url)
+
+        assert e.value.status == 502
+
+    async def test_client_errors_are_not_retried(self, url):
+        with aioresponses() as m:
+            m.get(url, status=404)
+            m.get(url, payload={"data": {"id": "guid0"}})
+            with pytest.raises(ClientResponseError) as e:
+                await get_with_retry(url)
+
+        assert e.value.status == 404
+
+    async def test_job_requests_made_once(self, url):
+        start_job_requests()
+        with aioresponses() as m:
+            m.get(f"{url}contributors/?page%5Bsize%5D=100", payload={"data": []})
+            # concurrent callers share the one in flight, later ones are served from memory
+            first, second = await asyncio.gather(
+                get_with_retry(f"{url}contributors/?page[size]=100&"),
+                get_with_retry(f"{url}contributors/?page[size]=100"),
+            )
+            third = await get_with_retry(f"{url}contributors/?page[size]=100")
+
+        assert first == second == third == {"data": []}
+        assert first is not second
+
+    def test_normalize_url(self, url):
+        assert normalize_url(f"{url}?page[size]=100&") == normalize_url(f"{url}?page[size]=100")
+        assert normalize_url(f"{url}?b=2&&a=1&=blank#top") == normalize_url(f"{url}?a=1&b=2")
+        assert normalize_url(f"{url}?page=2") != normalize_url(f"{url}?page=3")
+
+    async def test_job_requests_not_kept_for_bulky_endpoints(self, url):
+        start_job_requests()
+        with aioresponses() as m:
+            m.get(f"{url}logs/", payload={"data": [1]})
+            m.get(f"{url}logs/", payload={"data": [2]})
+            assert await get_with_retry(f"{url}logs/") == {"data": [1]}
+            assert await get_with_retry(f"{url}logs/") == {"data": [2]}
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after("120") == 120
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+
+class TestRateLimiter:
+    def test_spaces_requests_to_rate(self):
+        limiter = RateLimiter(rate=50, burst=1, max_in_flight=10)
+
+        async def acquire_many():
+            for _ in range(6):
+                async with limiter:
+                    pass
+
+        start = time.monotonic()
+        run(acquire_many())
+        assert time.monotonic() - start >= 0.1
+
+    def test_cool_down_pauses_callers(self):
+        limiter = RateLimiter(rate=0, burst=1, max_in_flight=10)
+        limiter.cool_down(0.1)
+
+        async def acquire():
+            async with limiter:
+                pass
+
+        start = time.monotonic()
+        run(acquire())
+        assert time.monotonic() - start >= 0.1
+
+    def test_in_flight_shared_across_event_loops(self):
+        limiter = RateLimiter(rate=0, burst=1, max_in_flight=2)
+        lock = threading.Lock()
+        counts = {"open": 0, "peak": 0}
+
+        async def request():
+            async with limiter:
+                with lock:
+                    counts["open"] += 1
+                    counts["peak"] = max(counts["peak"], counts["open"])
+                await asyncio.sleep(0.01)
+                with lock:
+                    counts["open"] -= 1
+
+        async def job():
+            await asyncio.gather(*[request() for _ in range(5)])
+
+        threads = [threading.Thread(target=run, args=(job(),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert counts == {"open": 0, "peak": 2}
+
+
+@pytest.mark.asyncio
+class TestHTTPCache:
+    @pytest.fixture
+    def cache_dir(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with mock.patch.object(settings, "HTTP_CACHE_DIR", temp_dir):
+                yield temp_dir
+
+    async def test_revalidates_with_etag(self, cache_dir):
+        url = f"{settings.OSF_API_URL}v2/licenses/guid0/"
+        with aioresponses() as m:
+            m.get(url, payload={"data": {"id": "cc0"}}, headers={"ETag": '"v1"'})
+            m.get(url, status=304)
+            assert await get_with_retry(url) == {"data": {"id": "cc0"}}
+            assert await get_with_retry(url) == {"data": {"id": "cc0"}}
+
+            revalidation = m.requests[("GET", URL(url))][1]
+            assert revalidation.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+    async def test_immutable_served_from_cache(self, cache_dir):
+        url = f"{settings.OSF_API_URL}v2/schemas/registrations/schema0/"
+        with aioresponses() as m:
+            m.get(url, payload={"data": {"id": "schema0"}})
+            assert await get_with_retry(url) == {"data": {"id": "schema0"}}
+            assert await get_with_retry(url) == {"data": {"id": "schema0"}}
+
+            assert len(m.requests[("GET", URL(url))]) == 1
+
+    async def test_cache_read_off_loop(self, cache_dir):
+        url = f"{settings.OSF_API_URL}v2/schemas/registrations/schema0/"
+        threads = []
+        get = HTTPCache.get
+
+        def record_get(cache, url):
+            threads.append(threading.current_thread())
+            return get(cache, url)
+
+        with aioresponses() as m, mock.patch.object(HTTPCache, "get", record_get):
+            m.get(url, payload={"data": {"id": "schema0"}})
+            await get_with_retry(url)
+            await get_with_retry(url)
+
+        assert threads and threading.current_thread() not in threads
+
+    def test_evicts_least_recently_used(self, cache_dir):
+        cache = HTTPCache(cache_dir, max_bytes=300)
+        cache.set("http://osf/first", "a" * 100, etag="1")
+        os.utime(cache._path("http://osf/first"), (0, 0))
+        cache.set("http://osf/second", "b" * 100, etag="2")
+        cache.set("http://osf/third", "c" * 100, etag="3")
+
+        assert cache.get("http://osf/first") is None
+        assert cache.get("http://osf/third")[1] == "c" * 100
+        assert cache._size <= 300
+
+
+@pytest.mark.asyncio
+class TestAdaptiveConcurrency:
+    @pytest.fixture
+    def url(self):
+        return f"{settings.OSF_API_URL}v2/registrations/guid0/logs/?page=2"
+
+    @pytest.fixture(autouse=True)
+    def paging_limits(self):
+        with mock.patch.dict(pigeon._paging_limits, clear=True):
+            yield pigeon._paging_limits
+
+    async def test_grows_while_latency_is_steady(self):
+        concurrency = AdaptiveConcurrency("logs", 4)
+        for _ in range(8):
+            concurrency._record(0.1, throttled=False)
+
+        assert 5 < concurrency.limit < 6
+        assert concurrency.latency == pytest.approx(0.1)
+
+    async def test_backs_off_on_latency_spike(self):
+        concurrency = AdaptiveConcurrency("logs", 8)
+        concurrency._record(0.1, throttled=False)
+        concurrency._record(1, throttled=False)
+
+        assert concurrency.limit < 5
+
+    async def test_backs_off_when_throttled(self, url):
+        concurrency = AdaptiveConcurrency("logs", 8)
+        with aioresponses() as m:
+            m.get(url, status=429, headers={"Retry-After": "0"})
+            m.get(url, payload={"data": []})
+            await concurrency.fetch(url)
+
+        assert concurrency.limit == 4
+        assert get_paging_stats()["logs"]["concurrency"] == 4
+
+
 @pytest.mark.asyncio
 class TestStreamFilesToDir:
     @pytest.fixture
@@ -50,6 +356,71 @@ class TestStreamFilesToDir:
             assert open(os.path.join(temp_dir, zip_name), "rb").read() == zip_data
 
 
+@pytest.mark.asyncio
+class TestDownloadFiles:
+    @pytest.fixture
+    def data(self):
+        return b"Brian Dawkins on game day"
+
+    @pytest.fixture
+    def osf_file(self, data):
+        return {
+            "attributes": {
+                "kind": "file",
+                "materialized_path": "/folder/dawkins.txt",
+                "size": len(data),
+                "extra": {
+                    "hashes": {
+                        "md5": hashlib.md5(data).hexdigest(),
+                        "sha256": hashlib.sha256(data).hexdigest(),
+                    }
+                },
+            },
+            "links": {"download": "https://osf.io/download/dawkins/"},
+        }
+
+    async def test_resume_partial_file(self, osf_file, data, tmp_path, payload):
+        os.mkdir(tmp_path / "folder")
+        with open(tmp_path / "folder/dawkins.txt", "wb") as fp:
+            fp.write(data[:10])
+
+        with aioresponses() as m:
+            m.get("https://osf.io/download/dawkins/", status=206, body=data[10:])
+            await download_file(osf_file, str(tmp_path))
+
+            request = m.requests[("GET", URL("https://osf.io/download/dawkins/"))][0]
+            assert request.kwargs["headers"] == {"Range": "bytes=10-"}
+
+        path = str(tmp_path / "folder/dawkins.txt")
+        assert open(path, "rb").read() == data
+        assert payload[path].digests["sha256"] == hashlib.sha256(data).hexdigest()
+
+    async def test_range_ignored(self, osf_file, data, tmp_path, payload):
+        os.mkdir(tmp_path / "folder")
+        with open(tmp_path / "folder/dawkins.txt", "wb") as fp:
+            fp.write(b"stale bytes")
+
+        with aioresponses() as m:
+            m.get("https://osf.io/download/dawkins/", status=200, body=data)
+            await download_file(osf_file, str(tmp_path))
+
+        assert open(tmp_path / "folder/dawkins.txt", "rb").read() == data
+
+    async def test_hash_mismatch(self, osf_file, tmp_path, payload):
+        with aioresponses() as m:
+            m.get("https://osf.io/download/dawkins/", status=200, body=b"Brian Dawkins on bye week")
+            with pytest.raises(FileIntegrityError, match="doesn't match its md5, sha256 on OSF"):
+                await download_file(osf_file, str(tmp_path))
+
+        assert not os.path.exists(tmp_path / "folder/dawkins.txt")
+        assert not payload
+
+    async def test_path_outside_osfstorage(self, osf_file, tmp_path):
+        osf_file["attributes"]["materialized_path"] = "/../../etc/passwd"
+        with pytest.raises(FileIntegrityError, match="outside of osfstorage"):
+            await download_file(osf_file, str(tmp_path))
+
+
 @pytest.mark.asyncio
 class TestDumpJSONFilesToDir:
     @pytest.fixture
@@ -120,7 +491,7 @@ class TestDumpJSONFilesToDirMultipage:
                 body=page1,
             )
             m.get(
-                f"{settings.OSF_API_URL}v2/registrations/{guid}/wikis/?page=2&page=2",
+                f"{settings.OSF_API_URL}v2/registrations/{guid}/wikis/?page=2",
                 body=page2,
             )
             with tempfile.TemporaryDirectory() as temp_dir:
@@ -135,6 +506,28 @@ class TestDumpJSONFilesToDirMultipage:
                 assert len(info) == 11
                 assert info == expected_json
 
+    async def test_streamed_json_matches_json_dump(
+        self, guid, page1, page2, file_name, expected_json
+    ):
+        with aioresponses() as m:
+            m.get(
+                f"{settings.OSF_API_URL}v2/registrations/{guid}/wikis/",
+                body=page1,
+            )
+            m.get(
+                f"{settings.OSF_API_URL}v2/registrations/{guid}/wikis/?page=2",
+                body=page2,
+            )
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with mock.patch.object(settings, "PAGING_MAX_BUFFERED_PAGES", 1):
+                    await dump_json_to_dir(
+                        f"{settings.OSF_API_URL}v2/registrations/{guid}/wikis/",
+                        temp_dir,
+                        file_name,
+                    )
+                with open(os.path.join(temp_dir, file_name)) as fp:
+                    assert fp.read() == json.dumps(expected_json)
+
 
 @pytest.mark.asyncio
 class TestContributors:
@@ -170,12 +563,14 @@ class TestContributors:
                 body=institutions_file,
             )
 
-            with tempfile.TemporaryDirectory() as temp_dir:
+            with tempfile.TemporaryDirectory() as temp_dir, paging_concurrency(
+                "institutions"
+            ) as concurrency:
                 await dump_json_to_dir(
                     f"{settings.OSF_API_URL}v2/registrations/{guid}/contributors/",
                     temp_dir,
                     file_name,
-                    parse_json=get_additional_contributor_info,
+                    parse_json=partial(get_additional_contributor_info, concurrency=concurrency),
                 )
                 assert len(os.listdir(temp_dir)) == 1
                 assert os.listdir(temp_dir)[0] == file_name
@@ -189,6 +584,245 @@ class TestContributors:
                 )
                 assert info[0]["affiliated_institutions"] == ["Center For Open Science"]
 
+    async def test_every_page_of_contributors_enriched(
+        self, guid, contributors_file, institutions_file, file_name
+    ):
+        _institutions_cache.clear()
+        page = json.loads(contributors_file)
+        page["links"]["next"] = "next page"
+        page["links"]["meta"].update(total=2, per_page=1)
+        url = f"{settings.OSF_API_URL}v2/registrations/{guid}/contributors/"
+        with aioresponses() as m, mock.patch(
+            "osf_pigeon.pigeon.get_paging_concurrency", wraps=pigeon.get_paging_concurrency
+        ) as get_paging_concurrency:
+            m.get(f"{url}?page%5Bsize%5D=100", payload=page)
+            m.get(f"{url}?page%5Bsize%5D=100&page=2", payload=page)
+            m.get(
+                "http://localhost:8000/v2/users/s3rbx/institutions/",
+                body=institutions_file,
+                repeat=True,
+            )
+            with tempfile.TemporaryDirectory() as temp_dir:
+                await dump_contributors_to_dir(guid, temp_dir)
+                info = json.loads(open(os.path.join(temp_dir, file_name)).read())
+
+        assert len(info) == 2
+        for contributor in info:
+            assert contributor["affiliated_institutions"] == ["Center For Open Science"]
+        # every page's institution lookups share the job's one controller
+        assert [
+            call.args[0] for call in get_paging_concurrency.call_args_list
+        ].count("institutions") == 1
+
+    async def test_institutions_cached_across_jobs(self, contributors_file, institutions_file):
+        _institutions_cache.clear()
+        with aioresponses() as m:
+            m.get(
+                "http://localhost:8000/v2/users/s3rbx/institutions/",
+                body=institutions_file,
+            )  # only mocked once, a second lookup would fail
+            for _ in range(2):
+                contributors = await get_additional_contributor_info(
+                    json.loads(contributors_file), AdaptiveConcurrency("institutions")
+                )
+                assert contributors["data"][0]["affiliated_institutions"] == [
+                    "Center For Open Science"
+                ]
+
+
+def write_payload(path, data):
+    async def write():
+        async with open_async(path, payload=True) as fp:
+            await fp.write(data)
+
+    run(write())
+
+
+class TestBag:
+    @pytest.fixture
+    def bag_dir(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.mkdir(os.path.join(temp_dir, "bag"))
+            yield os.path.join(temp_dir, "bag")
+
+    def test_payload_digests_recorded_while_writing(self, bag_dir, payload):
+        write_payload(os.path.join(bag_dir, "logs.json"), "[]")
+
+        payload_file = payload[os.path.join(bag_dir, "logs.json")]
+        assert payload_file.size == 2
+        assert payload_file.digests["sha256"] == hashlib.sha256(b"[]").hexdigest()
+
+    def test_build_bag_from_recorded_digests(self, bag_dir, payload):
+        os.mkdir(os.path.join(bag_dir, "files"))
+        write_payload(
+            os.path.join(bag_dir, "files", "archived_files.zip"), b"Brian Dawkins on game day"
+        )
+        with open(os.path.join(bag_dir, "unrecorded.json"), "w") as fp:
+            fp.write("{}")
+
+        with mock.patch("osf_pigeon.pigeon.hash_file", wraps=hash_file) as mock_hash_file:
+            build_bag(bag_dir, payload)
+
+        mock_hash_file.assert_called_once_with(
+            os.path.join(bag_dir, "data", "unrecorded.json"), settings.BAG_CHECKSUMS
+        )
+        bag = bagit.Bag(bag_dir)
+        assert bag.is_valid()
+        assert bag.info["Payload-Oxum"] == "27.2"
+        assert sorted(bag.payload_files()) == [
+            "data/files/archived_files.zip",
+            "data/unrecorded.json",
+        ]
+
+    def test_hash_files_in_parallel(self, bag_dir):
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(bag_dir, f"{i}.bin"))
+            with open(paths[-1], "wb") as fp:
+                fp.write(os.urandom(1024 * i))
+        expected = {path: hash_file(path, ["md5", "sha256"]) for path in paths}
+
+        with mock.patch.object(settings, "BAG_HASH_PROCESSES", 2):
+            assert hash_files(paths, ["md5", "sha256"]) == expected
+        with mock.patch.object(settings, "BAG_HASH_THREADED_SIZE", 0):
+            with mock.patch.object(settings, "BAG_HASH_CHUNK_SIZE", 100):
+                assert hash_file(paths[2], ["md5", "sha256"]) == expected[paths[2]]
+
+    def test_fast_validation_trusts_recorded_digests(self, bag_dir, payload):
+        write_payload(os.path.join(bag_dir, "logs.json"), "[]")
+        build_bag(bag_dir, payload)
+
+        with mock.patch("osf_pigeon.pigeon.hash_file") as mock_hash_file:
+            validate_bag(bag_dir, payload)
+        mock_hash_file.assert_not_called()
+
+        os.remove(os.path.join(bag_dir, "data", "logs.json"))
+        with pytest.raises(bagit.BagValidationError):
+            validate_bag(bag_dir, payload)
+
+    def test_create_zip_moves_bag_into_zip(self, bag_dir, payload):
+        write_payload(os.path.join(bag_dir, "logs.json"), "[]")
+        build_bag(bag_dir, payload)
+        temp_dir = os.path.dirname(bag_dir)
+
+        create_zip(temp_dir)
+
+        with zipfile.ZipFile(os.path.join(temp_dir, "bag.zip")) as zip_file:
+            assert zip_file.read("bag/data/logs.json") == b"[]"
+            assert "bag/manifest-sha256.txt" in zip_file.namelist()
+        assert not any(files for _, _, files in os.walk(bag_dir))
+
+    def test_create_zip_compression_policy(self, bag_dir, payload):
+        logs = json.dumps([{"action": "registration_approved"}] * 1000).encode()
+        write_payload(os.path.join(bag_dir, "logs.json"), logs)
+        write_payload(os.path.join(bag_dir, "archived_files.zip"), b"PK\x03\x04" + os.urandom(2048))
+        write_payload(os.path.join(bag_dir, "renamed_archive"), b"\x1f\x8b" + os.urandom(2048))
+        build_bag(bag_dir, payload)
+        temp_dir = os.path.dirname(bag_dir)
+
+        create_zip(temp_dir)
+
+        with zipfile.ZipFile(os.path.join(temp_dir, "bag.zip")) as zip_file:
+            assert zip_file.testzip() is None
+            assert zip_file.read("bag/data/logs.json") == logs
+            compress_types = {info.filename: info.compress_type for info in zip_file.infolist()}
+        assert compress_types["bag/data/logs.json"] == zipfile.ZIP_DEFLATED
+        assert compress_types["bag/manifest-sha256.txt"] == zipfile.ZIP_DEFLATED
+        assert compress_types["bag/data/archived_files.zip"] == zipfile.ZIP_STORED
+        assert compress_types["bag/data/renamed_archive"] == zipfile.ZIP_STORED
+        assert not any(files for _, _, files in os.walk(bag_dir))
+
+    def test_sampled_validation_rehashes(self, bag_dir, payload):
+        write_payload(os.path.join(bag_dir, "logs.json"), "[]")
+        build_bag(bag_dir, payload)
+        with open(os.path.join(bag_dir, "data", "logs.json"), "w") as fp:
+            fp.write("{}")  # same size, different bytes
+
+        validate_bag(bag_dir, payload)
+        with mock.patch.object(settings, "BAG_VALIDATION_SAMPLE_RATE", 1):
+            with pytest.raises(bagit.BagValidationError):
+                validate_bag(bag_dir, payload)
+
+
+class TestAsyncWriter:
+    class RecordingFile:
+        def __init__(self, release=None):
+            self.writes = []
+            self.closed = False
+            self.release = release
+
+        def write(self, b):
+            if self.release:
+                self.release.wait(5)
+            self.writes.append(bytes(b))
+            return len(b)
+
+        def close(self):
+            self.closed = True
+
+    def test_writes_coalesced_into_aligned_blocks(self):
+        fp = self.RecordingFile()
+
+        async def write():
+            writer = AsyncWriter(fp, chunk_size=4, buffer_size=16)
+            for char in "abcdefghij":
+                await writer.write(char)
+            await writer.write(b"klmnopqrstu")
+            await writer.aclose()
+
+        run(write())
+        assert fp.writes == [b"abcd", b"efgh", b"ijklmnopqrst", b"u"]
+        assert fp.closed
+
+    def test_backpressure(self):
+        release = threading.Event()
+        fp = self.RecordingFile(release)
+
+        async def write():
+            writer = AsyncWriter(fp, chunk_size=4, buffer_size=4)
+            await writer.write(b"abcd")  # within the buffer, doesn't wait on the disk
+            blocked = asyncio.ensure_future(writer.write(b"efgh"))
+            await asyncio.sleep(0.05)
+            assert not blocked.done()
+            release.set()
+            await blocked
+            await writer.aclose()
+
+        run(write())
+        assert b"".join(fp.writes) == b"abcdefgh"
+
+    def test_write_error_raised(self):
+        fp = self.RecordingFile()
+        fp.write = mock.Mock(side_effect=OSError("No space left on device"))
+
+        async def write():
+            writer = AsyncWriter(fp, chunk_size=4, buffer_size=4)
+            await writer.write(b"abcdefgh")
+
+        with pytest.raises(OSError, match="No space left on device"):
+            run(write())
+
+    def test_payload_recorded(self, payload, tmp_path):
+        path = str(tmp_path / "logs.json")
+
+        async def write():
+            async with open_async(path, payload=True) as fp:
+                await fp.write("[")
+                await fp.write(b"{}" * 1024 * 1024)
+                await fp.write("]")
+
+        run(write())
+        with open(path, "rb") as fp:
+            data = fp.read()
+        assert data == b"[" + b"{}" * 1024 * 1024 + b"]"
+        assert payload[path] == (
+            len(data),
+            {
+                algorithm: hashlib.new(algorithm, data).hexdigest()
+                for algorithm in settings.BAG_CHECKSUMS
+            },
+        )
+
 
 @pytest.mark.asyncio
 class TestDatacite:
@@ -208,15 +842,71 @@ class TestDatacite:
         with tempfile.TemporaryDirectory() as temp_dir:
             yield temp_dir
 
+    @pytest.fixture(autouse=True)
+    def datacite_cache(self):
+        _datacite_cache.clear()
+        yield _datacite_cache
+        _datacite_cache.clear()
+
     async def test_get_datacite_metadata(self, guid, mock_datacite, temp_dir, metadata):
+        xml = await write_datacite_metadata(guid, temp_dir, metadata)
+        assert xml == "pretend this is XML."
+        with open(os.path.join(temp_dir, "datacite.xml")) as fp:
+            assert fp.read() == "pretend this is XML."
+
+        request = mock_datacite.requests[
+            ("GET", URL("https://mds.test.datacite.org/metadata/10.70102/osf.io/guid0"))
+        ][0]
+        assert request.kwargs["auth"].login == settings.DATACITE_USERNAME
+        assert request.kwargs["headers"]["Accept"] == "application/xml"
+
+    async def test_datacite_not_found(self, guid, temp_dir, metadata):
         with aioresponses() as m:
             m.get(
                 "https://mds.test.datacite.org/metadata/10.70102/osf.io/guid0",
-                status=200,
-                body=b"pretend this is XML.",
+                status=404,
+                body=b"DOI not found",
             )
-            xml = await write_datacite_metadata(guid, temp_dir, metadata)
-            assert xml == "pretend this is XML."
+            with pytest.raises(DataCiteNotFoundError, match="guid0 on Datacite server"):
+                await write_datacite_metadata(guid, temp_dir, metadata)
+
+    async def test_datacite_retry_and_cache(self, guid, temp_dir, metadata):
+        url = "https://mds.test.datacite.org/metadata/10.70102/osf.io/guid0"
+        with aioresponses() as m:
+            m.get(url, status=503)
+            m.get(url, status=200, body=b"pretend this is XML.")
+            assert await write_datacite_metadata(guid, temp_dir, metadata) == (
+                "pretend this is XML."
+            )
+            assert await write_datacite_metadata(guid, temp_dir, metadata) == (
+                "pretend this is XML."
+            )
+            assert len(m.requests[("GET", URL(url))]) == 2  # one retry, then cached
+
+    @pytest.mark.parametrize(
+        "datacite_url, expected",
+        [
+            (None, "https://mds.datacite.org/"),
+            ("https://mds.test.datacite.org", "https://mds.test.datacite.org/"),
+            ("https://mds.test.datacite.org/", "https://mds.test.datacite.org/"),
+        ],
+    )
+    async def test_datacite_url(self, guid, temp_dir, metadata, datacite_url, expected):
+        with aioresponses() as m, mock.patch.object(settings, "DATACITE_URL", datacite_url):
+            m.get(f"{expected}metadata/10.70102/osf.io/guid0", body=b"pretend this is XML.")
+            assert await write_datacite_metadata(guid, temp_dir, metadata) == (
+                "pretend this is XML."
+            )
+
+    @pytest.mark.parametrize(
+        "status, error", [(403, DataCiteForbiddenError), (503, DataCiteServerError)]
+    )
+    async def test_datacite_errors(self, guid, temp_dir, metadata, status, error):
+        url = "https://mds.test.datacite.org/metadata/10.70102/osf.io/guid0"
+        with aioresponses() as m:
+            m.get(url, status=status, repeat=True)
+            with pytest.raises(error):
+                await write_datacite_metadata(guid, temp_dir, metadata)
 
 
 @pytest.mark.asyncio
@@ -285,7 +975,7 @@ class TestMetadata:
             )
             m.get(
                 f"{settings.OSF_API_URL}v2/registrations/8gqkv/contributors/"
-                f"?filter%5Bbibliographic%5D=true",
+                f"?page%5Bsize%5D=100",
                 body=biblio_contribs,
             )
             m.get(
@@ -332,11 +1022,18 @@ class TestMetadata:
             "description": "Test Description",
             "date": "2017-12-20",
         }
-        sync_metadata(guid, metadata)
+        _, updated = sync_metadata(guid, metadata)
         mock_ia_client.session.get_item.assert_called_with(
             f"osf-registrations-guid0-{settings.ID_VERSION}"
         )
-        mock_ia_client.item.modify_metadata.assert_called_with(metadata)
+        # the description is already on IA
+        assert updated == ["title", "date"]
+        assert sent_metadata_patches(mock_ia_client.session) == [
+            [
+                {"op": "add", "path": "/title", "value": "Test Component"},
+                {"op": "add", "path": "/date", "value": "2017-12-20"},
+            ]
+        ]
 
     def test_modify_metadata_not_public(self, mock_ia_client, guid):
         metadata = {
@@ -350,13 +1047,142 @@ class TestMetadata:
             f"osf-registrations-guid0-{settings.ID_VERSION}"
         )
 
-        metadata["noindex"] = True
-        metadata[
-            "description"
-        ] = "Note this registration has been withdrawn: \nTest Description"
+        assert sent_metadata_patches(mock_ia_client.session) == [
+            [
+                {"op": "add", "path": "/title", "value": "Test Component"},
+                {
+                    "op": "add",
+                    "path": "/description",
+                    "value": "Note this registration has been withdrawn: \nTest Description",
+                },
+                {"op": "add", "path": "/date", "value": "2017-12-20"},
+                {
+                    "op": "add",
+                    "path": "/withdrawal_justification",
+                    "value": "We're talkin' about practice!",
+                },
+                {"op": "add", "path": "/noindex", "value": "true"},
+            ]
+        ]
+
+    def test_repeated_withdrawal_not_written(self, mock_ia_client, guid):
+        metadata = {"withdrawal_justification": "We're talkin' about practice!"}
+        _, updated = sync_metadata(guid, dict(metadata))
+        assert sorted(updated) == ["description", "noindex", "withdrawal_justification"]
+
+        _, updated = sync_metadata(guid, dict(metadata))
+        assert updated == []
+        assert mock_ia_client.item.metadata["description"] == (
+            "Note this registration has been withdrawn: \nTest Description"
+        )
+        assert len(sent_metadata_patches(mock_ia_client.session)) == 1
+
+    def test_lists_written_whole(self, mock_ia_client, guid):
+        # IA has since had "subject b" removed, the cached metadata hasn't caught up
+        mock_ia_client.item.item_metadata["metadata"]["osf_subjects"] = [
+            "subject a", "subject b", "subject c"
+        ]
+        sync_metadata(guid, {"osf_subjects": ["subject a", "subject d"]})
+
+        [request] = [call.args[0] for call in mock_ia_client.session.send.call_args_list]
+        assert request.url == (
+            f"https://archive.org/metadata/osf-registrations-guid0-{settings.ID_VERSION}"
+        )
+        assert parse_qs(request.body)["-target"] == ["metadata"]
+        assert sent_metadata_patches(mock_ia_client.session) == [
+            [{"op": "add", "path": "/osf_subjects", "value": ["subject a", "subject d"]}]
+        ]
+
+    def test_unchanged_metadata_not_written(self, mock_ia_client, guid):
+        mock_ia_client.item.item_metadata["metadata"].update(
+            {"title": "Test Component", "osf_tags": "practice", "noindex": "true"}
+        )
+        _, updated = sync_metadata(
+            guid,
+            {
+                "title": "Test Component",
+                "osf_tags": ["practice"],
+                "description": "Test Description",
+            },
+        )
+        assert updated == []
+        mock_ia_client.session.send.assert_not_called()
 
-        mock_ia_client.item.modify_metadata.assert_any_call({"noindex": True})
-        mock_ia_client.item.modify_metadata.assert_any_call(metadata)
+    def test_normalize_ia_value(self):
+        assert normalize_ia_value(["practice"]) == "practice"
+        assert normalize_ia_value(["practice", "games"]) == ["practice", "games"]
+        assert normalize_ia_value([]) == normalize_ia_value(None) == ""
+        assert normalize_ia_value(True) == "true"
+        assert normalize_ia_value(2017) == "2017"
+
+    def test_item_metadata_cached(self, mock_ia_client, guid):
+        item_name = f"osf-registrations-guid0-{settings.ID_VERSION}"
+        sync_metadata(guid, {"title": "Test Component"})
+        sync_metadata(guid, {"osf_tags": ["practice"]})
+
+        assert mock_ia_client.call_count == 1  # one session for the process
+        assert mock_ia_client.session.get_item.call_args_list == [
+            mock.call(item_name),
+            mock.call(
+                item_name,
+                item_metadata={
+                    "metadata": {"description": "Test Description", "title": "Test Component"}
+                },
+            ),
+        ]
+        assert _ia_item_cache.get(item_name) == {
+            "metadata": {
+                "description": "Test Description",
+                "title": "Test Component",
+                "osf_tags": ["practice"],
+            }
+        }
+
+    def test_failed_write_drops_cached_metadata(self, mock_ia_client, guid):
+        item_name = f"osf-registrations-guid0-{settings.ID_VERSION}"
+        mock_ia_client.session.send.return_value.json.return_value = {
+            "success": False,
+            "error": "no changes to _meta.xml",
+        }
+        mock_ia_client.session.send.return_value.status_code = 200
+        with pytest.raises(MetadataSyncError, match="no changes to _meta.xml"):
+            sync_metadata(guid, {"title": "Test Component"})
+        assert _ia_item_cache.get(item_name) is None
+
+    async def test_failed_write_reported_by_bulk_sync(self, mock_ia_client, guid):
+        response = mock_ia_client.session.send.return_value
+        response.ok = False
+        response.status_code = 400
+        response.json.side_effect = ValueError("not json")
+        response.text = "Bad Request"
+
+        async def updates():
+            yield guid, {"title": "Test Component"}
+
+        results = [
+            result
+            async for result in sync_metadata_bulk(MetadataSyncQueue(sync_metadata), updates())
+        ]
+        assert results == [
+            (
+                guid,
+                {
+                    "error": f"Metadata write to osf-registrations-guid0-{settings.ID_VERSION} "
+                    "failed (400): Bad Request"
+                },
+            )
+        ]
+
+
+class TestIASession:
+    def test_s3_requests_not_retried_by_urllib3(self):
+        with mock.patch.object(pigeon, "_ia_session", None):
+            session = pigeon.get_ia_session()
+
+        s3_adapter = session.get_adapter(f"{settings.IA_S3_URL}osf-registrations-guid0/bag.zip")
+        assert s3_adapter.max_retries.total == 0
+        assert s3_adapter._pool_maxsize == settings.IA_WORKERS
+        assert session.get_adapter("https://archive.org/metadata/guid0").max_retries.total == 3
 
 
 @pytest.mark.asyncio
@@ -375,6 +1201,8 @@ class TestUpload:
     @pytest.fixture
     def temp_dir(self):
         with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "bag.zip"), "wb") as fp:
+                fp.write(b"pretend this is a bag")
             yield temp_dir
 
     @pytest.fixture
@@ -417,7 +1245,7 @@ class TestUpload:
             )
             m.add(
                 f"{settings.OSF_API_URL}v2/registrations/8gqkv/contributors/"
-                f"?filter%5Bbibliographic%5D=true",
+                f"?page%5Bsize%5D=100",
                 body=biblio_contribs,
             )
             m.add(
@@ -490,7 +1318,7 @@ class TestUpload:
             )
             m.get(
                 f"{settings.OSF_API_URL}v2/registrations/8gqkv/contributors/"
-                f"?filter%5Bbibliographic%5D=true",
+                f"?page%5Bsize%5D=100",
                 body=biblio_contribs,
             )
             m.get(
@@ -539,3 +1367,440 @@ class TestUpload:
                 secret_key=settings.IA_SECRET_KEY,
                 access_key=settings.IA_ACCESS_KEY,
             )
+
+
+class TestConcurrentArchive:
+    @pytest.mark.parametrize("files_download_mode", ["zip", "files"])
+    def test_concurrent_archives(
+        self, stand_in_servers, mock_ia_client, tmp_path, files_download_mode
+    ):
+        guids = [f"guid{i}" for i in range(8)]
+        verified = set()
+        lock = threading.Lock()
+
+        def check_upload(zip_path, metadata, **kwargs):
+            guid = metadata["title"]
+            extract_dir = tmp_path / guid
+            with zipfile.ZipFile(zip_path) as zf:
+                zf.extractall(extract_dir)
+            bag = bagit.Bag(str(extract_dir / "bag"))
+            bag.validate()  # full re-hash of every payload file
+
+            with open(extract_dir / "bag/data/registration.json") as fp:
+                assert json.load(fp)["data"]["id"] == guid
+            with open(extract_dir / "bag/data/contributors.json") as fp:
+                assert [contrib["id"] for contrib in json.load(fp)] == [
+                    f"{guid}-brian", f"{guid}-reggie", f"{guid}-randall"
+                ]
+            if files_download_mode == "zip":
+                with open(extract_dir / "bag/data/archived_files.zip", "rb") as fp:
+                    assert fp.read() == f"archived files of {guid}".encode()
+            else:  # every first download is cut off, so these were all resumed
+                for path in [
+                    "/data.csv",
+                    "/README.md",
+                    "/folder/analysis.R",
+                    "/folder/results.csv",
+                    "/folder/notes.txt",
+                ]:
+                    with open(extract_dir / f"bag/data/archived_files{path}", "rb") as fp:
+                        assert fp.read() == get_stand_in_file(guid, path)
+            with lock:
+                verified.add(guid)
+
+        mock_ia_client.item.upload.side_effect = check_upload
+
+        async def archive_all():
+            return await asyncio.gather(*(run_job(archive(guid)) for guid in guids))
+
+        with mock.patch.multiple(
+            settings,
+            PIGEON_TEMP_DIR=str(tmp_path),
+            MAX_ARCHIVE_JOBS=4,
+            FILES_DOWNLOAD_MODE=files_download_mode,
+        ):
+            results = run(archive_all())  # every job on one event loop, as in the app
+
+        assert [guid for _, guid in results] == guids
+        assert verified == set(guids)
+        if files_download_mode == "files":
+            assert len(stand_in_servers["resumed"]) == len(guids) * 5
+        assert not [path for path in os.listdir(tmp_path) if path not in guids]
+
+    def test_job_cap(self):
+        running = []
+        peak = []
+
+        async def job(i):
+            running.append(i)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(i)
+            return i
+
+        async def run_jobs():
+            return await asyncio.gather(*(run_job(job(i)) for i in range(10)))
+
+        with mock.patch.object(settings, "MAX_ARCHIVE_JOBS", 3):
+            assert run(run_jobs()) == list(range(10))
+        assert max(peak) == 3
+
+    def test_temp_dir_removed_off_loop(self, tmp_path):
+        removed = []
+        real_rmtree = shutil.rmtree
+
+        def rmtree(path, ignore_errors=False):
+            removed.append((path, threading.current_thread()))
+            real_rmtree(path, ignore_errors)
+
+        with mock.patch.object(settings, "PIGEON_TEMP_DIR", str(tmp_path)), mock.patch(
+            "osf_pigeon.pigeon.get_registration_metadata", side_effect=ValueError("OSF is down")
+        ), mock.patch("osf_pigeon.pigeon.shutil.rmtree", rmtree):
+            with pytest.raises(ValueError, match="OSF is down"):
+                run(archive("guid0"))
+
+        assert not os.listdir(tmp_path)  # removed when the job failed too
+        [(path, thread)] = removed
+        assert os.path.dirname(path) == str(tmp_path)
+        assert thread is not threading.current_thread()
+
+    def test_run_blocking_off_loop(self):
+        async def blocking_thread():
+            return await run_blocking("bag", threading.current_thread)
+
+        assert run(blocking_thread()) is not threading.current_thread()
+
+
+class TestArchiveWorker:
+    def test_result_is_picklable(self):
+        ia_item = mock.Mock(identifier="osf-registrations-guid0-test_v1")
+        ia_item.urls.details = "https://archive.org/details/osf-registrations-guid0-test_v1"
+
+        async def archive(guid):
+            return ia_item, guid
+
+        with mock.patch("osf_pigeon.pigeon.archive", archive):
+            item, guid = pickle.loads(pickle.dumps(archive_worker("guid0")))
+
+        assert guid == "guid0"
+        assert item.identifier == ia_item.identifier
+        assert item.urls.details == ia_item.urls.details
+
+    def test_unpicklable_error(self):
+        async def archive(guid):
+            raise ClientResponseError(mock.Mock(), (), status=502, message="Bad Gateway")
+
+        with mock.patch("osf_pigeon.pigeon.archive", archive):
+            with pytest.raises(ArchiveWorkerError, match="502, message='Bad Gateway'") as e:
+                archive_worker("guid0")
+
+        assert isinstance(pickle.loads(pickle.dumps(e.value)), ArchiveWorkerError)
+
+    def test_error_marshalled_from_pool(self, stand_in_servers, tmp_path):
+        with mock.patch.object(settings, "PIGEON_TEMP_DIR", str(tmp_path)):
+            with mock.patch.object(pigeon, "_archive_pool", None):
+                pool = get_archive_pool()  # workers start with the patched settings
+                try:
+                    future = pool.submit(archive_worker, "withdrawn0")
+                    with pytest.raises(PermissionError, match="withdrawn0 is withdrawn"):
+                        future.result(timeout=60)
+                finally:
+                    pool.shutdown()
+
+    @pytest.mark.parametrize(
+        "pool_name, get_pool", [("_archive_pool", get_archive_pool), ("_hash_pool", get_hash_pool)]
+    )
+    def test_broken_pool_replaced(self, pool_name, get_pool):
+        with mock.patch.object(pigeon, pool_name, None):
+            pool = get_pool()
+            try:
+                with pytest.raises(BrokenProcessPool):
+                    pool.submit(os._exit, 1).result(timeout=60)  # a worker dies
+                assert get_pool() is not pool
+                assert get_pool().submit(abs, -1).result(timeout=60) == 1
+            finally:
+                getattr(pigeon, pool_name).shutdown()
+
+    def test_workers_have_own_rate_limits(self):
+        with mock.patch.multiple(
+            settings,
+            ARCHIVE_PROCESSES=4,
+            BAG_HASH_PROCESSES=4,
+            RATE_LIMIT_PER_SECOND=10,
+            RATE_LIMIT_BURST=10,
+            RATE_LIMIT_MAX_IN_FLIGHT=20,
+            PROCESS_RATE_LIMIT_PER_SECOND=3,
+            PROCESS_RATE_LIMIT_BURST=2,
+            PROCESS_RATE_LIMIT_MAX_IN_FLIGHT=5,
+        ):
+            init_archive_worker({})
+            assert settings.RATE_LIMIT_PER_SECOND == 3
+            assert settings.RATE_LIMIT_BURST == 2
+            assert settings.RATE_LIMIT_MAX_IN_FLIGHT == 5
+            assert settings.BAG_HASH_PROCESSES == 1
+
+
+@pytest.mark.asyncio
+class TestMultipartUpload:
+    @pytest.fixture
+    def bag_zip(self, tmp_path):
+        path = str(tmp_path / "bag.zip")
+        with open(path, "wb") as fp:
+            fp.write(os.urandom(50 * 1024))
+        return path
+
+    @pytest.fixture(autouse=True)
+    def part_size(self):
+        with mock.patch.object(settings, "IA_UPLOAD_PART_SIZE", 8 * 1024):
+            yield
+
+    async def test_multipart_upload(self, stand_in_servers, bag_zip):
+        stand_in_servers["s3_failing_parts"].add(3)
+
+        await multipart_upload(
+            "osf-registrations-guid0-test_v1", bag_zip, {"collection": "cos-dev-sandbox"}
+        )
+
+        headers, body = stand_in_servers["s3_objects"][
+            ("osf-registrations-guid0-test_v1", "bag.zip")
+        ]
+        assert body == open(bag_zip, "rb").read()
+        assert headers["x-archive-meta00-collection"] == "cos-dev-sandbox"
+        assert headers["Authorization"] == (
+            f"LOW {settings.IA_ACCESS_KEY}:{settings.IA_SECRET_KEY}"
+        )
+        assert sorted(stand_in_servers["s3_part_requests"]) == [1, 2, 3, 3, 4, 5, 6, 7]
+
+    async def test_resume_multipart_upload(self, stand_in_servers, bag_zip):
+        with open(bag_zip, "rb") as fp:
+            data = fp.read()
+        stand_in_servers["s3_uploads"]["upload0"] = (
+            "osf-registrations-guid0-test_v1",
+            "bag.zip",
+            {},
+            {1: data[:8 * 1024], 2: data[8 * 1024:16 * 1024], 3: b"a part of an older bag"},
+        )
+
+        await multipart_upload("osf-registrations-guid0-test_v1", bag_zip, {})
+
+        _, body = stand_in_servers["s3_objects"][("osf-registrations-guid0-test_v1", "bag.zip")]
+        assert body == data
+        assert sorted(stand_in_servers["s3_part_requests"]) == [3, 4, 5, 6, 7]
+
+    async def test_no_upload_to_resume_for_new_item(self):
+        with aioresponses() as m:
+            m.get(re.compile(r".*[?&]uploads"), status=404)
+            assert await get_multipart_upload("osf-registrations-guid0-test_v1", "bag.zip") == (
+                None,
+                {},
+            )
+
+    async def test_upload_listing_errors_raised(self):
+        with aioresponses() as m:
+            m.get(re.compile(r".*[?&]uploads"), status=403)
+            with pytest.raises(ClientResponseError) as e:
+                await get_multipart_upload("osf-registrations-guid0-test_v1", "bag.zip")
+
+        assert e.value.status == 403
+
+
+@pytest.mark.asyncio
+class TestMetadataSyncQueue:
+    @pytest.fixture
+    def syncs(self):
+        return []
+
+    @pytest.fixture
+    def sync(self, syncs):
+        def sync(guid, metadata):
+            syncs.append((guid, metadata))
+            time.sleep(0.05)  # a write to IA
+            syncs.append((guid, "done"))
+            return guid, list(metadata)
+
+        return sync
+
+    async def test_updates_coalesced(self, sync, syncs):
+        queue = MetadataSyncQueue(sync)
+        first = queue.submit("guid0", {"title": "Practice", "osf_tags": ["practice"]})
+        second = queue.submit("guid0", {"title": "We're talkin' about practice"})
+        other = queue.submit("guid1", {"title": "Game day"})
+        assert first is second
+
+        assert await first == ("guid0", ["title", "osf_tags"])
+        await other
+        assert sorted(call for call in syncs if call[1] != "done") == [
+            ("guid0", {"title": "We're talkin' about practice", "osf_tags": ["practice"]}),
+            ("guid1", {"title": "Game day"}),
+        ]
+
+    async def test_syncs_ordered(self, sync, syncs):
+        queue = MetadataSyncQueue(sync)
+        first = queue.submit("guid0", {"title": "Practice"})
+        while not syncs:  # wait for the first sync to start
+            await asyncio.sleep(0.01)
+        second = queue.submit("guid0", {"title": "Game day"})
+        await asyncio.gather(first, second)
+
+        assert syncs == [
+            ("guid0", {"title": "Practice"}),
+            ("guid0", "done"),
+            ("guid0", {"title": "Game day"}),
+            ("guid0", "done"),
+        ]
+
+    async def test_invalid_update_rejected(self, sync, syncs):
+        queue = MetadataSyncQueue(sync)
+        future = queue.submit("guid0", {"title": "Practice"})
+        with pytest.raises(http_exceptions.PayloadEncodingError):
+            queue.submit("guid0", {"moderation_state": "withdrawn"})
+
+        await future
+        assert syncs[0] == ("guid0", {"title": "Practice"})
+
+    async def test_sync_error(self, syncs):
+        def sync(guid, metadata):
+            raise ConnectionError("archive.org is down")
+
+        queue = MetadataSyncQueue(sync, window=0)
+        with pytest.raises(ConnectionError):
+            await queue.submit("guid0", {"title": "Practice"})
+
+
+@pytest.mark.asyncio
+class TestSyncMetadataBulk:
+    @staticmethod
+    async def iter_updates(updates):
+        for update in updates:
+            yield update
+
+    async def test_bulk_sync(self):
+        syncing = []
+        most_syncing = 0
+
+        def sync(guid, metadata):
+            nonlocal most_syncing
+            syncing.append(guid)
+            most_syncing = max(most_syncing, len(syncing))
+            time.sleep(0.05)  # a write to IA
+            syncing.remove(guid)
+            return guid, list(metadata)
+
+        updates = [(f"guid{i}", {"title": f"Practice {i}"}) for i in range(10)]
+        updates.append(("guid10", {"moderation_state": "withdrawn"}))
+        queue = MetadataSyncQueue(sync, executor=ThreadPoolExecutor(max_workers=10))
+        results = {
+            guid: result
+            async for guid, result in sync_metadata_bulk(
+                queue, self.iter_updates(updates), concurrency=3
+            )
+        }
+
+        assert most_syncing == 3
+        assert "invalid tag(s): `moderation_state`" in results.pop("guid10")["error"]
+        assert results == {f"guid{i}": {"updated": ["title"]} for i in range(10)}
+
+    async def test_bulk_sync_error(self):
+        def sync(guid, metadata):
+            if guid == "guid1":
+                raise ConnectionError("archive.org is down")
+            return guid, list(metadata)
+
+        updates = [("guid0", {"title": "Practice"}), ("guid1", {"title": "Game day"})]
+        results = [
+            result
+            async for result in sync_metadata_bulk(
+                MetadataSyncQueue(sync), self.iter_updates(updates)
+            )
+        ]
+
+        assert sorted(results) == [
+            ("guid0", {"updated": ["title"]}),
+            ("guid1", {"error": "archive.org is down"}),
+        ]
+
+
+@pytest.mark.asyncio
+class TestBulkMetadataEndpoint:
+    @pytest.fixture
+    async def client(self):
+        from osf_pigeon import app
+
+        def sync(guid, metadata):
+            return guid, list(metadata)
+
+        web_app = web.Application()
+        web_app.add_routes(app.routes)
+        with mock.patch.object(app, "metadata_syncs", MetadataSyncQueue(sync, window=0)):
+            async with TestClient(TestServer(web_app)) as client:
+                yield client
+
+    async def test_json_batch(self, client):
+        resp = await client.post(
+            "/metadata",
+            json={"guid0": {"title": "Practice"}, "guid1": {"moderation_state": "withdrawn"}},
+        )
+
+        assert resp.status == 200
+        results = await resp.json()
+        assert results["guid0"] == {"updated": ["title"]}
+        assert "invalid tag(s): `moderation_state`" in results["guid1"]["error"]
+
+    async def test_ndjson_batch_with_bad_lines(self, client):
+        resp = await client.post(
+            "/metadata",
+            data=(
+                '{"guid0": {"title": "Practice"}}\n'
+                "not json\n"
+                '["guid1"]\n'
+                "\n"
+                '{"guid2": {"title": "Game day"}, "guid3": "Practice"}\n'
+            ),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        assert resp.status == 200
+        lines = [json.loads(line) for line in (await resp.text()).splitlines()]
+        results = {
+            key: value for line in lines if "error" not in line for key, value in line.items()
+        }
+        errors = sorted(line["error"] for line in lines if "error" in line)
+        assert "Metadata payload must be a json object" in results.pop("guid3")["error"]
+        assert results == {"guid0": {"updated": ["title"]}, "guid2": {"updated": ["title"]}}
+        assert errors[0].startswith("Line 2: ")
+        assert errors[1] == "Line 3: Expected an object of guid to metadata"
+
+    async def test_ndjson_oversized_line(self, client):
+        long_title = "Practice " * (200 * 1024 // 9)  # past StreamReader's own line limit
+        with mock.patch.object(settings, "BULK_METADATA_MAX_LINE_SIZE", 256 * 1024):
+            resp = await client.post(
+                "/metadata",
+                data=(
+                    json.dumps({"guid0": {"title": long_title}}) + "\n"
+                    + json.dumps({"guid1": {"title": long_title * 2}}) + "\n"
+                    + '{"guid2": {"title": "Game day"}}\n'
+                ),
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+            assert resp.status == 200
+            lines = [json.loads(line) for line in (await resp.text()).splitlines()]
+
+        assert sorted(lines, key=json.dumps) == [
+            {"error": f"Line 2: Longer than the {256 * 1024} byte limit"},
+            {"guid0": {"updated": ["title"]}},
+            {"guid2": {"updated": ["title"]}},
+        ]
+
+    @pytest.mark.parametrize(
+        "body, content_type",
+        [
+            ("guid0=Practice", "application/x-www-form-urlencoded"),
+            ("not json", "application/json"),
+            ('["guid0"]', "application/json"),
+        ],
+    )
+    async def test_bad_request(self, client, body, content_type):
+        resp = await client.post("/metadata", data=body, headers={"Content-Type": content_type})
+
+        assert resp.status == 400
+        assert "error" in await resp.json()